@@ -0,0 +1,171 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+
+from junos_bgp import iter_chunks, iter_elements
+from junos_fleet import CONNECT_TIMEOUT, MAX_WORKERS, RPC_TIMEOUT, add_governor_args, governor_from_args, iter_fleet
+from junos_inventory import load_inventory
+from junos_sessions import RpcReplyError
+from session_broker import DEFAULT_SOCKET, connect_pool
+
+# The committed configuration as "show configuration" prints it
+CONFIG_RPC = '<get-configuration database="committed" format="text"/>'
+
+
+def parse_config(reply):
+    """
+    Return the configuration text from a get-configuration reply.
+    """
+    for name, elem in iter_elements(iter_chunks(reply)):
+        if name == "configuration-text":
+            return elem.text or ""
+    raise RpcReplyError("No configuration-text in reply")
+
+
+def fetch_config(pool, device):
+    return parse_config(pool.rpc(device, CONFIG_RPC))
+
+
+class ConfigStore:
+    """
+    Content-addressed store of configuration backups.
+
+    Each distinct configuration is written once, zlib-compressed, under
+    objects/ by its SHA-256. refs/<host> names the object holding a
+    device's latest backup, and history.jsonl records every time a ref
+    moves. An unchanged configuration costs a hash and a comparison with
+    the current ref, and writes nothing.
+    """
+
+    def __init__(self, root="config_backups"):
+        self.root = root
+        self.objects = os.path.join(root, "objects")
+        self.refs = os.path.join(root, "refs")
+        os.makedirs(self.objects, mode=0o700, exist_ok=True)
+        os.makedirs(self.refs, mode=0o700, exist_ok=True)
+        self.history_path = os.path.join(root, "history.jsonl")
+        self._lock = threading.Lock()
+
+    def object_path(self, digest):
+        return os.path.join(self.objects, digest[:2], digest[2:])
+
+    def ref_path(self, host):
+        return os.path.join(self.refs, host.replace(os.sep, "_"))
+
+    def read_ref(self, host):
+        try:
+            with open(self.ref_path(host)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def get(self, digest):
+        with open(self.object_path(digest), "rb") as f:
+            return zlib.decompress(f.read()).decode()
+
+    def put(self, text):
+        """
+        Store text if no identical object exists yet. Returns (digest, written).
+        """
+        data = text.encode()
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        if os.path.exists(path):
+            return digest, False
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        write_file(path, zlib.compress(data, 9))
+        return digest, True
+
+    def backup(self, host, text):
+        """
+        Record text as host's latest configuration.
+
+        Returns (digest, status), where status is "unchanged", "new" (first
+        backup of host) or "changed".
+        """
+        digest = hashlib.sha256(text.encode()).hexdigest()
+        previous = self.read_ref(host)
+        if previous == digest:
+            return digest, "unchanged"
+
+        self.put(text)
+        write_file(self.ref_path(host), f"{digest}\n".encode())
+        with self._lock, open(self.history_path, "a") as f:
+            f.write(json.dumps({"time": time.time(), "host": host, "object": digest, "previous": previous}) + "\n")
+        return digest, "new" if previous is None else "changed"
+
+
+def write_file(path, data):
+    """
+    Atomically write data, readable only by its owner.
+    """
+    # Devices with identical configurations may store the same object at once
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Back up Junos configurations into a deduplicated store.")
+    parser.add_argument("--inventory", default="device_inventory.yml",
+                        help="Device inventory file (default: device_inventory.yml)")
+    parser.add_argument("--site", help="Only back up devices at this site")
+    parser.add_argument("--category", help="Only back up devices in this category")
+    parser.add_argument("--host", action="append", help="Only back up this device (repeatable)")
+    parser.add_argument("--tag", action="append", default=[],
+                        help="Only back up devices carrying this inventory tag (repeatable)")
+    parser.add_argument("--store", default="config_backups",
+                        help="Backup store directory (default: config_backups)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                        help=f"Devices processed in parallel (default: {MAX_WORKERS})")
+    add_governor_args(parser)
+    parser.add_argument("--connect-timeout", type=float, default=CONNECT_TIMEOUT,
+                        help=f"Seconds allowed for each device to connect (default: {CONNECT_TIMEOUT})")
+    parser.add_argument("--rpc-timeout", type=float, default=RPC_TIMEOUT,
+                        help=f"Seconds allowed for each configuration RPC (default: {RPC_TIMEOUT})")
+    parser.add_argument("--broker", default=DEFAULT_SOCKET,
+                        help=f"Session broker socket to use when one is running (default: {DEFAULT_SOCKET})")
+    parser.add_argument("--no-broker", action="store_true",
+                        help="Always open private NETCONF sessions, even if a broker is running")
+    args = parser.parse_args()
+
+    inventory = load_inventory(args.inventory)
+    devices = inventory.select(site=args.site, category=args.category, hosts=args.host, tags=args.tag)
+    if not devices:
+        print("No matching devices found. Please check your inventory and filters.")
+        exit()
+
+    store = ConfigStore(args.store)
+    pool = connect_pool(args.broker, not args.no_broker, connect_timeout=args.connect_timeout,
+                        rpc_timeout=args.rpc_timeout)
+    governor = governor_from_args(args)
+
+    def process_device(device):
+        # Hashing and writing happen in the worker threads too
+        return store.backup(device["host"], fetch_config(pool, device))
+
+    start = time.perf_counter()
+    counts = {"unchanged": 0, "new": 0, "changed": 0, "failed": 0}
+    try:
+        for device, outcome, error in iter_fleet(devices, process_device, max_workers=args.workers,
+                                                 governor=governor):
+            if error:
+                print(f"Error backing up {device['host']}: {error}")
+                counts["failed"] += 1
+                continue
+            digest, status = outcome
+            counts[status] += 1
+            if status != "unchanged":
+                print(f"{device['host']}: {status} ({digest[:12]})")
+    finally:
+        pool.close_all()
+
+    print(f"\n=== Summary ({time.perf_counter() - start:.1f}s) ===")
+    for status, count in counts.items():
+        print(f"  {status}: {count}")
@@ -0,0 +1,143 @@
+"""
+Benchmark the BGP collection path against a local mock NETCONF fleet.
+
+    python benchmarks/bench_collector.py --devices 100 --peers 1000 --rpc-latency 0.05
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from junos_bgp import STANDARD_BUNDLE, fetch_bgp_peers, parse_fields, start_parser_pool  # noqa: E402
+from junos_fleet import MAX_WORKERS, iter_fleet  # noqa: E402
+from junos_sessions import NetconfSessionPool  # noqa: E402
+
+
+def percentile(values, pct):
+    """
+    Return the pct-th percentile of values (nearest rank).
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process in MiB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def start_mock_fleet(args):
+    """
+    Start the mock fleet in a child process so its memory is not counted.
+    """
+    command = [
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_netconf.py"),
+        "--devices", str(args.devices), "--peers", str(args.peers),
+        "--handshake-delay", str(args.handshake_delay), "--rpc-latency", str(args.rpc_latency),
+        "--failure-rate", str(args.failure_rate),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    devices = json.loads(process.stdout.readline())
+    return process, devices
+
+
+def run_pass(pool, devices, workers, parser_pool=None, fields=None):
+    """
+    Collect every device once and return (wall time, latencies, peers, errors).
+    """
+    def timed_collect(device):
+        start = time.perf_counter()
+        count = sum(1 for _ in fetch_bgp_peers(pool, device, parser_pool, fields))
+        return count, time.perf_counter() - start
+
+    latencies, peers, errors = [], 0, 0
+    start = time.perf_counter()
+    for device, result, error in iter_fleet(devices, timed_collect, max_workers=workers):
+        if error:
+            errors += 1
+            continue
+        peers += result[0]
+        latencies.append(result[1])
+    return time.perf_counter() - start, latencies, peers, errors
+
+
+def run_bundle_pass(pool, devices, workers, pipelined):
+    """
+    Fetch STANDARD_BUNDLE from every device, pipelined or one RPC at a time.
+    """
+    def timed_bundle(device):
+        start = time.perf_counter()
+        if pipelined:
+            pool.rpc_bundle(device, STANDARD_BUNDLE)
+        else:
+            for rpc in STANDARD_BUNDLE.values():
+                pool.rpc(device, rpc)
+        return 0, time.perf_counter() - start
+
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    for device, result, error in iter_fleet(devices, timed_bundle, max_workers=workers):
+        if error:
+            errors += 1
+            continue
+        latencies.append(result[1])
+    return time.perf_counter() - start, latencies, 0, errors
+
+
+def report(label, devices, elapsed, latencies, peers, errors):
+    print(f"\n=== {label} ===")
+    print(f"Devices: {len(devices)}  ok: {len(latencies)}  failed: {errors}  peers: {peers}")
+    print(f"Wall time: {elapsed:.2f}s  throughput: {len(devices) / elapsed:.1f} devices/s")
+    print(
+        f"Per-device latency p50: {percentile(latencies, 50) * 1000:.1f}ms  "
+        f"p95: {percentile(latencies, 95) * 1000:.1f}ms  "
+        f"p99: {percentile(latencies, 99) * 1000:.1f}ms"
+    )
+    print(f"Peak RSS: {peak_rss_mb():.1f} MiB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark BGP collection against a mock NETCONF fleet.")
+    parser.add_argument("--devices", type=int, default=20, help="Mock endpoints (default: 20)")
+    parser.add_argument("--peers", type=int, default=500, help="BGP peers per endpoint (default: 500)")
+    parser.add_argument("--handshake-delay", type=float, default=0.0, help="Seconds before each SSH handshake")
+    parser.add_argument("--rpc-latency", type=float, default=0.0, help="Seconds before each RPC reply")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of connections dropped")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                        help=f"Devices collected in parallel (default: {MAX_WORKERS})")
+    parser.add_argument("--passes", type=int, default=2,
+                        help="Collection passes; later passes reuse pooled sessions (default: 2)")
+    parser.add_argument("--parse-processes", type=int, default=0,
+                        help="Parse replies in this many worker processes (default: 0, parse in threads)")
+    parser.add_argument("--fields", help="Collect only these comma-separated peer fields (default: all)")
+    parser.add_argument("--bundle", action="store_true",
+                        help="Also compare sequential and pipelined runs of the standard RPC bundle")
+    args = parser.parse_args()
+
+    parser_pool = start_parser_pool(args.parse_processes) if args.parse_processes else None
+    process, devices = start_mock_fleet(args)
+    try:
+        with NetconfSessionPool() as pool:
+            for number in range(1, args.passes + 1):
+                label = "Cold sessions" if number == 1 else f"Warm sessions (pass {number})"
+                report(label, devices, *run_pass(pool, devices, args.workers, parser_pool, parse_fields(args.fields)))
+            if args.bundle:
+                report("Bundle, sequential RPCs", devices, *run_bundle_pass(pool, devices, args.workers, False))
+                report("Bundle, pipelined RPCs", devices, *run_bundle_pass(pool, devices, args.workers, True))
+    finally:
+        process.terminate()
+        process.wait()
+        if parser_pool:
+            parser_pool.shutdown()
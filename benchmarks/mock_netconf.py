@@ -0,0 +1,484 @@
+"""
+Fake Junos NETCONF-over-SSH endpoints on loopback for benchmarking.
+
+    python benchmarks/mock_netconf.py --devices 50 --peers 500
+"""
+import argparse
+import functools
+import json
+import random
+import re
+import socket
+import threading
+import time
+
+import paramiko
+
+MSG_DELIM = b"]]>]]>"
+BASE_NS = "urn:ietf:params:xml:ns:netconf:base:1.0"
+JUNOS_NS = "http://xml.juniper.net/junos/20.4R0/junos"
+
+HELLO = (
+    f'<?xml version="1.0" encoding="UTF-8"?><hello xmlns="{BASE_NS}"><capabilities>'
+    "<capability>urn:ietf:params:netconf:base:1.0</capability>"
+    "<capability>urn:ietf:params:netconf:capability:notification:1.0</capability>"
+    "<capability>http://xml.juniper.net/netconf/junos/1.0</capability>"
+    "</capabilities><session-id>{session_id}</session-id></hello>"
+)
+
+PEER_TEMPLATE = (
+    "<bgp-peer><peer-address>10.{a}.{b}.{c}+179</peer-address><peer-as>{asn}</peer-as>"
+    "<local-address>10.255.{a}.1+{port}</local-address><local-as>65000</local-as>"
+    "<peer-group>ebgp</peer-group><peer-type>External</peer-type>"
+    "<peer-state>{state}</peer-state><flap-count>{flaps}</flap-count>"
+    "<last-state>OpenConfirm</last-state><last-event>RecvKeepAlive</last-event>"
+    "<bgp-rib><name>inet.0</name><active-prefix-count>{active}</active-prefix-count>"
+    "<received-prefix-count>{received}</received-prefix-count>"
+    "<accepted-prefix-count>{received}</accepted-prefix-count></bgp-rib></bgp-peer>"
+)
+
+STATES = ("Established",) * 8 + ("Active", "Idle")
+
+
+NOTIFICATION_NS = "urn:ietf:params:xml:ns:netconf:notification:1.0"
+
+
+@functools.lru_cache(maxsize=None)
+def bgp_peer_elements(peers, seed=0):
+    """
+    Build the <bgp-peer> elements of a get-bgp-neighbor-information reply.
+    """
+    rng = random.Random(seed)
+    elements = []
+    for i in range(peers):
+        received = rng.randint(0, 5000)
+        elements.append(PEER_TEMPLATE.format(
+            a=(i >> 16) & 0xff, b=(i >> 8) & 0xff, c=i & 0xff,
+            asn=64512 + rng.randint(0, 1000), port=rng.randint(1024, 65535),
+            state=rng.choice(STATES), flaps=rng.randint(0, 20),
+            active=received // 2, received=received,
+        ))
+    return tuple(elements)
+
+
+@functools.lru_cache(maxsize=None)
+def bgp_summary_elements(peers, seed=0):
+    """
+    Build the <bgp-peer> elements of a get-bgp-summary-information reply.
+    """
+    rng = random.Random(seed)
+    elements = []
+    for i in range(peers):
+        received = rng.randint(0, 5000)
+        elements.append(
+            f"<bgp-peer><peer-address>10.{(i >> 16) & 0xff}.{(i >> 8) & 0xff}.{i & 0xff}</peer-address>"
+            f"<peer-as>{64512 + rng.randint(0, 1000)}</peer-as><flap-count>{rng.randint(0, 20)}</flap-count>"
+            f"<peer-state>{rng.choice(STATES)}</peer-state><bgp-rib><name>inet.0</name>"
+            f"<active-prefix-count>{received // 2}</active-prefix-count>"
+            f"<received-prefix-count>{received}</received-prefix-count></bgp-rib></bgp-peer>"
+        )
+    return tuple(elements)
+
+
+@functools.lru_cache(maxsize=None)
+def bgp_reply_body(peers, seed=0):
+    """
+    Build a get-bgp-neighbor-information reply body with this many peers.
+    """
+    return f'<bgp-information xmlns="{JUNOS_NS}-routing">{"".join(bgp_peer_elements(peers, seed))}</bgp-information>'
+
+
+@functools.lru_cache(maxsize=None)
+def bgp_summary_body(peers, seed=0):
+    """
+    Build a get-bgp-summary-information reply body with this many peers.
+    """
+    return (
+        f'<bgp-information xmlns="{JUNOS_NS}-routing"><peer-count>{peers}</peer-count>'
+        f'{"".join(bgp_summary_elements(peers, seed))}</bgp-information>'
+    )
+
+
+def peer_state(element):
+    return re.search(r"<peer-state>([^<]*)</peer-state>", element).group(1)
+
+
+def with_state(element, state):
+    return re.sub(r"<peer-state>[^<]*</peer-state>", f"<peer-state>{state}</peer-state>", element)
+
+
+def bgp_event_notification(address, old, new):
+    """
+    Build a notification carrying a BGP_NEIGHBOR_STATE_CHANGED syslog event.
+    """
+    event_time = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    return (
+        f'<notification xmlns="{NOTIFICATION_NS}"><eventTime>{event_time}</eventTime>'
+        f"<system-log-message><message-id>BGP_NEIGHBOR_STATE_CHANGED</message-id>"
+        f"<message>bgp_state_change_event: BGP peer {address} (External AS 64512) changed state from "
+        f"{old} to {new} (event RecvNotify) (instance master)</message></system-log-message></notification>"
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def route_reply_body(routes, seed=0):
+    """
+    Build a get-route-information reply with this many /24 routes.
+
+    Each seed drops and re-routes a different 1% of the table, so tables
+    from different mock devices differ slightly.
+    """
+    rng = random.Random(seed)
+    parts = [f'<route-information xmlns="{JUNOS_NS}-routing"><route-table><table-name>inet.0</table-name>']
+    for i in range(routes):
+        roll = rng.random()
+        if roll < 0.01:
+            continue
+        hop = 2 if roll < 0.02 else 1
+        parts.append(
+            f"<rt><rt-destination>{1 + (i >> 16) % 223}.{(i >> 8) & 0xff}.{i & 0xff}.0/24</rt-destination>"
+            f"<rt-entry><active-tag>*</active-tag><protocol-name>BGP</protocol-name><preference>170</preference>"
+            f"<nh><selected-next-hop/><to>192.0.2.{hop}</to><via>xe-0/0/{hop}.0</via></nh></rt-entry></rt>"
+        )
+    parts.append("</route-table></route-information>")
+    return "".join(parts)
+
+
+@functools.lru_cache(maxsize=None)
+def config_reply_body(seed=0, interfaces=48):
+    """
+    Build a get-configuration reply in text format for mock device seed.
+    """
+    lines = [
+        "## Last commit: 2024-01-01 00:00:00 UTC by admin",
+        "version 20.4R3.8;",
+        "system {",
+        f"    host-name mock{seed};",
+        "    services { netconf { ssh; } }",
+        "}",
+        "interfaces {",
+    ]
+    for i in range(interfaces):
+        lines += [
+            f"    xe-0/0/{i} {{",
+            f"        description \"uplink {i}\";",
+            f"        unit 0 {{ family inet {{ address 10.254.{i}.1/30; }} }}",
+            "    }",
+        ]
+    lines.append("}")
+    text = "\n".join(lines) + "\n"
+    return f'<configuration-text xmlns="{JUNOS_NS}">{text}</configuration-text>'
+
+
+ROUTE_SUMMARY_BODY = (
+    f'<route-summary-information xmlns="{JUNOS_NS}-routing"><route-table>'
+    "<table-name>inet.0</table-name><destination-count>850000</destination-count>"
+    "<total-route-count>1700000</total-route-count><active-route-count>850000</active-route-count>"
+    "</route-table></route-summary-information>"
+)
+
+INTERFACES_BODY = (
+    f'<interface-information xmlns="{JUNOS_NS}-interface" junos:style="terse">'
+    + "".join(
+        f"<physical-interface><name>xe-0/0/{i}</name><admin-status>up</admin-status>"
+        f"<oper-status>up</oper-status><logical-interface><name>xe-0/0/{i}.0</name>"
+        f"<admin-status>up</admin-status><oper-status>up</oper-status><address-family>"
+        f"<address-family-name>inet</address-family-name><interface-address>"
+        f"<ifa-local>10.254.{i}.1/30</ifa-local></interface-address></address-family>"
+        f"</logical-interface></physical-interface>"
+        for i in range(48)
+    )
+    + "</interface-information>"
+)
+
+OSPF_BODY = (
+    f'<ospf-neighbor-information xmlns="{JUNOS_NS}-routing">'
+    + "".join(
+        f"<ospf-neighbor><neighbor-address>10.254.{i}.2</neighbor-address><interface-name>xe-0/0/{i}.0"
+        f"</interface-name><ospf-neighbor-state>Full</ospf-neighbor-state><neighbor-id>10.0.{i}.1"
+        f"</neighbor-id><neighbor-priority>128</neighbor-priority><activity-timer>35</activity-timer>"
+        f"</ospf-neighbor>"
+        for i in range(8)
+    )
+    + "</ospf-neighbor-information>"
+)
+
+LLDP_BODY = (
+    f'<lldp-neighbors-information xmlns="{JUNOS_NS}-lldp">'
+    + "".join(
+        f"<lldp-neighbor-information><lldp-local-port-id>xe-0/0/{i}</lldp-local-port-id>"
+        f"<lldp-remote-chassis-id>00:05:86:71:{i:02x}:c0</lldp-remote-chassis-id>"
+        f"<lldp-remote-port-id>xe-0/0/47</lldp-remote-port-id>"
+        f"<lldp-remote-system-name>peer{i}</lldp-remote-system-name></lldp-neighbor-information>"
+        for i in range(8)
+    )
+    + "</lldp-neighbors-information>"
+)
+
+
+class MockDevice:
+    """
+    Behaviour of one fake router.
+    """
+
+    def __init__(self, peers=100, handshake_delay=0.0, rpc_latency=0.0, failure_rate=0.0, seed=0, routes=1000,
+                 event_interval=0.0):
+        self.peers = peers
+        self.seed = seed
+        self.event_interval = event_interval
+        # Peer states changed by flap(), by peer index
+        self.states = {}
+        self.rng = random.Random(seed)
+        self.routes = routes
+        self.handshake_delay = handshake_delay
+        self.rpc_latency = rpc_latency
+        self.failure_rate = failure_rate
+        self.handlers = {
+            "get-bgp-neighbor-information": lambda rpc: self.bgp_reply(rpc, bgp_peer_elements, bgp_reply_body),
+            "get-bgp-summary-information": lambda rpc: self.bgp_reply(rpc, bgp_summary_elements, bgp_summary_body),
+            "get-route-summary-information": lambda rpc: ROUTE_SUMMARY_BODY,
+            "get-route-information": lambda rpc: route_reply_body(self.routes, seed),
+            "get-interface-information": lambda rpc: INTERFACES_BODY,
+            "get-ospf-neighbor-information": lambda rpc: OSPF_BODY,
+            "get-lldp-neighbors-information": lambda rpc: LLDP_BODY,
+            "get-configuration": lambda rpc: config_reply_body(seed),
+        }
+
+    def bgp_reply(self, rpc, elements, body):
+        """
+        Answer a BGP RPC, for one peer if it names a neighbor-address, with
+        any states changed by flap() applied.
+        """
+        states = dict(self.states)
+        match = re.search(r"<neighbor-address>\s*([\d.]+)\s*<", rpc)
+        if match:
+            a, b, c = (int(octet) for octet in match.group(1).split(".")[1:])
+            index = a << 16 | b << 8 | c
+            indexes = [index] if match.group(1).startswith("10.") and index < self.peers else []
+        elif not states:
+            return body(self.peers, self.seed)
+        else:
+            indexes = range(self.peers)
+        peers = elements(self.peers, self.seed)
+        parts = [with_state(peers[i], states[i]) if i in states else peers[i] for i in indexes]
+        return f'<bgp-information xmlns="{JUNOS_NS}-routing">{"".join(parts)}</bgp-information>'
+
+    def flap(self):
+        """
+        Change a random peer's state and return the notification announcing it.
+        """
+        index = self.rng.randrange(self.peers)
+        old = self.states.get(index) or peer_state(bgp_peer_elements(self.peers, self.seed)[index])
+        new = "Idle" if old == "Established" else "Established"
+        self.states[index] = new
+        return bgp_event_notification(f"10.{(index >> 16) & 0xff}.{(index >> 8) & 0xff}.{index & 0xff}", old, new)
+
+    def reply(self, rpc):
+        """
+        Return the reply body for an RPC, or None if it is not supported.
+        """
+        match = re.search(r"<(?:\w+:)?rpc\b[^>]*>\s*<(?:\w+:)?([\w-]+)", rpc)
+        name = match.group(1) if match else ""
+        handler = self.handlers.get(name)
+        return handler(rpc) if handler else None
+
+
+class NetconfServerInterface(paramiko.ServerInterface):
+    """
+    Accept any password and the netconf subsystem.
+    """
+
+    def __init__(self):
+        self.subsystem_ready = threading.Event()
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_subsystem_request(self, channel, name):
+        if name == "netconf":
+            self.subsystem_ready.set()
+            return True
+        return False
+
+
+def read_message(channel, buffer):
+    """
+    Read one ]]>]]> delimited message; returns (message, rest) or (None, b"").
+    """
+    while MSG_DELIM not in buffer:
+        data = channel.recv(65536)
+        if not data:
+            return None, b""
+        buffer += data
+    message, _, rest = buffer.partition(MSG_DELIM)
+    return message.decode(), rest
+
+
+def send_message(channel, text):
+    channel.sendall(text.encode() + MSG_DELIM)
+
+
+class MockNetconfEndpoint:
+    """
+    One fake router listening on 127.0.0.1.
+    """
+
+    session_ids = iter(range(1, 1 << 30))
+
+    def __init__(self, device, host_key, host="127.0.0.1", port=0):
+        self.device = device
+        self.host_key = host_key
+        self.sock = socket.create_server((host, port), backlog=128)
+        self.host, self.port = self.sock.getsockname()[:2]
+        self.thread = threading.Thread(target=self._accept, daemon=True)
+        self.thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def _serve(self, client):
+        if random.random() < self.device.failure_rate:
+            client.close()
+            return
+        time.sleep(self.device.handshake_delay)
+
+        transport = paramiko.Transport(client)
+        transport.add_server_key(self.host_key)
+        server = NetconfServerInterface()
+        try:
+            transport.start_server(server=server)
+            channel = transport.accept(30)
+            if channel is None or not server.subsystem_ready.wait(30):
+                return
+            self.handle_session(channel)
+        except (EOFError, OSError, paramiko.SSHException):
+            pass
+        finally:
+            transport.close()
+
+    def handle_session(self, channel):
+        """
+        Exchange hellos, then answer RPCs until the client closes the session.
+        """
+        send_message(channel, HELLO.format(session_id=next(self.session_ids)))
+        hello, buffer = read_message(channel, b"")
+        if hello is None:
+            return
+
+        ended = threading.Event()
+        try:
+            while True:
+                rpc, buffer = read_message(channel, buffer)
+                if rpc is None:
+                    return
+                if "create-subscription" in rpc:
+                    self.subscribe(channel, rpc, ended)
+                elif not self.handle_rpc(channel, rpc):
+                    return
+        finally:
+            ended.set()
+
+    def subscribe(self, channel, rpc, ended):
+        """
+        Accept a create-subscription and send a BGP state change notification
+        every event_interval seconds (on average) until the session ends.
+        """
+        match = re.search(r'message-id="([^"]*)"', rpc)
+        send_message(channel, self.wrap(match.group(1) if match else "", "<ok/>"))
+        if not self.device.event_interval:
+            return
+
+        def notify():
+            while not ended.wait(random.expovariate(1 / self.device.event_interval)):
+                try:
+                    send_message(channel, self.device.flap())
+                except (OSError, EOFError):
+                    return
+
+        threading.Thread(target=notify, daemon=True).start()
+
+    def handle_rpc(self, channel, rpc):
+        """
+        Answer one RPC; returns False once the session should end.
+        """
+        match = re.search(r'message-id="([^"]*)"', rpc)
+        message_id = match.group(1) if match else ""
+        time.sleep(self.device.rpc_latency)
+
+        if "close-session" in rpc:
+            send_message(channel, self.wrap(message_id, "<ok/>"))
+            return False
+
+        body = self.device.reply(rpc)
+        if body is None:
+            body = (
+                "<rpc-error><error-type>protocol</error-type><error-tag>operation-not-supported</error-tag>"
+                "<error-severity>error</error-severity><error-message>unsupported RPC</error-message></rpc-error>"
+            )
+        send_message(channel, self.wrap(message_id, body))
+        return True
+
+    def wrap(self, message_id, body):
+        return f'<rpc-reply xmlns="{BASE_NS}" xmlns:junos="{JUNOS_NS}" message-id="{message_id}">{body}</rpc-reply>'
+
+    def close(self):
+        self.sock.close()
+
+
+def start_fleet(count, peers=100, handshake_delay=0.0, rpc_latency=0.0, failure_rate=0.0,
+                endpoint_class=MockNetconfEndpoint, routes=1000, event_interval=0.0):
+    """
+    Start count endpoints and return them.
+    """
+    host_key = paramiko.RSAKey.generate(2048)
+    return [
+        endpoint_class(MockDevice(peers, handshake_delay, rpc_latency, failure_rate, seed=i, routes=routes,
+                                  event_interval=event_interval), host_key)
+        for i in range(count)
+    ]
+
+
+def fleet_inventory(endpoints):
+    """
+    Return inventory-style device dicts for a list of endpoints.
+    """
+    return [
+        {"host": endpoint.host, "port": endpoint.port, "user": "bench", "password": "bench",
+         "site": "bench", "category": "mock"}
+        for endpoint in endpoints
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a fleet of fake Junos NETCONF endpoints.")
+    parser.add_argument("--devices", type=int, default=10, help="Number of endpoints (default: 10)")
+    parser.add_argument("--peers", type=int, default=100, help="BGP peers per endpoint (default: 100)")
+    parser.add_argument("--routes", type=int, default=1000, help="inet.0 routes per endpoint (default: 1000)")
+    parser.add_argument("--handshake-delay", type=float, default=0.0, help="Seconds before the SSH handshake")
+    parser.add_argument("--rpc-latency", type=float, default=0.0, help="Seconds before each RPC reply")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of connections dropped")
+    parser.add_argument("--event-interval", type=float, default=0.0,
+                        help="Mean seconds between BGP state change notifications per subscription (default: none)")
+    args = parser.parse_args()
+
+    endpoints = start_fleet(args.devices, args.peers, args.handshake_delay, args.rpc_latency, args.failure_rate,
+                            routes=args.routes, event_interval=args.event_interval)
+    print(json.dumps(fleet_inventory(endpoints)), flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,395 @@
+import argparse
+import heapq
+import json
+import random
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from bgp_snapshot import SnapshotStore, format_change
+from bgp_store import open_sink
+from bgp_timeseries import FLAP_WINDOW, PeerHistory
+from junos_bgp import fetch_bgp_peer, fetch_bgp_peers, parse_fields, start_parser_pool
+from junos_events import BgpSubscriber
+from junos_fleet import CONNECT_TIMEOUT, RPC_TIMEOUT, add_governor_args, governor_from_args
+from junos_inventory import load_inventory
+from junos_metrics import PhaseMetrics, timed
+from junos_sessions import NetconfSessionPool
+
+# Polling defaults
+POLL_INTERVAL = 300
+JITTER = 0.1
+MAX_BACKOFF = 3600
+MAX_SESSIONS = 20
+METRICS_INTERVAL = 60
+RECONCILE_INTERVAL = 3600
+FLAP_CHECK_INTERVAL = 60
+
+
+def log(message):
+    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {message}", flush=True)
+
+
+def parse_intervals(values):
+    """
+    Parse repeated CATEGORY=SECONDS options into a dict.
+    """
+    intervals = {}
+    for value in values:
+        category, _, seconds = value.partition("=")
+        intervals[category] = float(seconds)
+    return intervals
+
+
+class PollScheduler:
+    """
+    Priority queue of devices ordered by when they are next due.
+
+    Each device polls on its own interval with random jitter. A failing
+    device backs off exponentially up to max_backoff seconds.
+    """
+
+    def __init__(self, default_interval=POLL_INTERVAL, category_intervals=None,
+                 jitter=JITTER, max_backoff=MAX_BACKOFF):
+        self.default_interval = default_interval
+        self.category_intervals = category_intervals or {}
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.failures = {}
+        self._heap = []
+        self._seq = 0
+
+    def interval(self, device):
+        """
+        Return a device's poll interval: its own, its category's, or the default.
+        """
+        if device.get("poll_interval"):
+            return float(device["poll_interval"])
+        return self.category_intervals.get(device.get("category"), self.default_interval)
+
+    def _push(self, due, device):
+        self._seq += 1
+        heapq.heappush(self._heap, (due, self._seq, device))
+
+    def _jittered(self, delay):
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def add(self, device, now, spread=None):
+        """
+        Schedule a new device at a random offset within its first interval
+        (or within spread seconds), so a fresh start does not poll the
+        whole fleet at once.
+        """
+        self._push(now + random.uniform(0, spread or self.interval(device)), device)
+
+    def reschedule(self, device, now, ok):
+        """
+        Queue a device's next poll after a success or a failure.
+        """
+        host = device["host"]
+        if ok:
+            self.failures.pop(host, None)
+            delay = self.interval(device)
+        else:
+            self.failures[host] = self.failures.get(host, 0) + 1
+            delay = min(self.interval(device) * 2 ** (self.failures[host] - 1), self.max_backoff)
+        self._push(now + self._jittered(delay), device)
+
+    def next_due(self):
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        """
+        Pop the next device if it is due, otherwise return None.
+        """
+        if self._heap and self._heap[0][0] <= now:
+            return heapq.heappop(self._heap)[2]
+        return None
+
+
+def run_collector(devices, args):
+    """
+    Poll devices forever, reusing NETCONF sessions between polls.
+    """
+    intervals = parse_intervals(args.category_interval)
+    if args.subscribe:
+        # Notifications carry the changes; full polls only reconcile
+        intervals = {}
+        scheduler = PollScheduler(args.reconcile_interval, intervals, args.jitter, args.max_backoff)
+    else:
+        scheduler = PollScheduler(args.interval, intervals, args.jitter, args.max_backoff)
+    now = time.monotonic()
+    for device in devices:
+        # Subscriptions start after a device's first poll, so that one comes soon
+        scheduler.add(device, now, args.interval if args.subscribe else None)
+
+    fields = parse_fields(args.fields)
+    parser_pool = start_parser_pool(args.parse_processes) if args.parse_processes else None
+    metrics = PhaseMetrics() if args.metrics_prom or args.metrics_json else None
+    metrics_due = time.monotonic() + args.metrics_interval
+
+    # Keep sessions open for at least two poll cycles between uses
+    pool = NetconfSessionPool(
+        idle_timeout=max([scheduler.default_interval, *intervals.values()]) * 2 + 60,
+        connect_timeout=args.connect_timeout,
+        rpc_timeout=args.rpc_timeout,
+        metrics=metrics,
+    )
+    sink = open_sink(args.output)
+    snapshots = SnapshotStore(args.snapshots)
+    history = PeerHistory(args.history) if args.history else None
+    flap_check_due = time.monotonic() + FLAP_CHECK_INTERVAL
+    # Peers last reported as flapping, so each is only logged when it starts
+    flapping = set()
+    changes_file = open(args.changes_file, "a")
+    executor = ThreadPoolExecutor(max_workers=args.max_sessions)
+    inflight = {}
+    governor = governor_from_args(args)
+    # Devices that are due but waiting for their site to have room, in due order
+    held = []
+    subscriber = BgpSubscriber(pool, governor=governor) if args.subscribe else None
+    # Event-driven fetches: future -> (device, peer address, or None for a full poll)
+    updates = {}
+    # Peers being fetched, and those with news since their fetch was sent
+    refreshing, stale = set(), set()
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+
+    def poll(device):
+        try:
+            return list(fetch_bgp_peers(pool, device, parser_pool, fields))
+        finally:
+            if governor:
+                governor.release(device)
+
+    def record(host, changes):
+        for change in changes:
+            log(format_change(host, change))
+            changes_file.write(json.dumps({"time": time.time(), "device": host, **change}) + "\n")
+
+    def store(device, address, peers):
+        """
+        Write a poll (address None) or a refresh of one peer, then log and
+        save what changed since the last snapshot.
+        """
+        host = device["host"]
+        with timed(metrics, host, "write", device.get("site")):
+            if address is None:
+                sink.write(host, peers)
+            else:
+                sink.update(host, peers)
+            if history:
+                history.record(host, peers)
+        if address is None:
+            record(host, snapshots.diff(host, peers))
+        elif peers:
+            record(host, snapshots.update(host, peers))
+        else:
+            log(f"{host}: peer {address} no longer reported; the next full poll will drop it")
+
+    def refresh(device, address):
+        if address is None:
+            return list(fetch_bgp_peers(pool, device, parser_pool, fields))
+        return fetch_bgp_peer(pool, device, address, fields)
+
+    def admit(device, blocked):
+        """
+        Claim the device's site slot unless its group is already blocked.
+        """
+        key = governor.keys(device)[1]
+        if key in blocked or governor.try_acquire(device) != 0:
+            blocked.add(key)
+            return False
+        return True
+
+    log(f"Collecting BGP peers from {len(devices)} device(s), at most {args.max_sessions} at a time")
+    if subscriber:
+        log(f"Following BGP state change notifications, with a full poll every {args.reconcile_interval:g}s")
+    try:
+        while not stopping:
+            now = time.monotonic()
+
+            # Re-read only the peers a notification reported as changed. A
+            # peer already being fetched is fetched once more afterwards.
+            while subscriber and not subscriber.events.empty():
+                device, address, old, new = subscriber.events.get_nowait()
+                if (device["host"], address) in refreshing:
+                    stale.add((device["host"], address))
+                    continue
+                if address is None:
+                    log(f"Subscription to {device['host']} restored; polling it in full")
+                refreshing.add((device["host"], address))
+                updates[executor.submit(refresh, device, address)] = (device, address)
+            while subscriber and not subscriber.errors.empty():
+                device, error = subscriber.errors.get_nowait()
+                log(f"Subscription to {device['host']} lost: {error}")
+
+            # Start every due device while under the global session cap,
+            # letting throttled sites wait without holding up the others
+            blocked = set()
+            for device in list(held):
+                if len(inflight) >= args.max_sessions:
+                    break
+                if admit(device, blocked):
+                    held.remove(device)
+                    inflight[executor.submit(poll, device)] = device
+            while len(inflight) < args.max_sessions:
+                device = scheduler.pop_due(now)
+                if device is None:
+                    break
+                if governor and not admit(device, blocked):
+                    held.append(device)
+                    continue
+                inflight[executor.submit(poll, device)] = device
+
+            next_due = scheduler.next_due()
+            timeout = 1.0 if next_due is None else min(max(next_due - now, 0.05), 1.0)
+            if held:
+                timeout = min(timeout, 0.1)
+            if subscriber:
+                timeout = min(timeout, 0.2)
+            if not inflight and not updates:
+                time.sleep(timeout)
+                continue
+
+            done, _ = wait([*inflight, *updates], timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in updates:
+                    device, address = updates.pop(future)
+                    host = device["host"]
+                    if (host, address) in stale:
+                        stale.discard((host, address))
+                        updates[executor.submit(refresh, device, address)] = (device, address)
+                    else:
+                        refreshing.discard((host, address))
+                    try:
+                        peers = future.result()
+                    except Exception as e:
+                        log(f"Error refreshing {host} {address or ''}: {e}")
+                        continue
+                    try:
+                        store(device, address, peers)
+                    except Exception as e:
+                        log(f"Error storing {host} {address or ''}: {e}")
+                    continue
+
+                device = inflight.pop(future)
+                host = device["host"]
+                try:
+                    peers = future.result()
+                except Exception as e:
+                    scheduler.reschedule(device, time.monotonic(), ok=False)
+                    log(f"Error polling {host} (failure {scheduler.failures[host]}): {e}")
+                    continue
+
+                scheduler.reschedule(device, time.monotonic(), ok=True)
+                try:
+                    store(device, None, peers)
+                except Exception as e:
+                    log(f"Error storing {host}: {e}")
+                if subscriber:
+                    subscriber.start(device)
+            if done:
+                sink.flush()
+                changes_file.flush()
+
+            if history and args.flap_alert and time.monotonic() >= flap_check_due:
+                found = history.flapping(args.flap_window, args.flap_alert)
+                for peer in found:
+                    if (peer["device"], peer["peer"]) not in flapping:
+                        log(f"{peer['device']} ! {peer['peer']} flapping: {peer['flaps']} flaps, "
+                            f"{peer['state_changes']} state changes in {args.flap_window:g}s")
+                flapping = {(peer["device"], peer["peer"]) for peer in found}
+                flap_check_due = time.monotonic() + FLAP_CHECK_INTERVAL
+
+            # Export metrics live so scrapers see the collector as it runs
+            if metrics and time.monotonic() >= metrics_due:
+                metrics.write(args.metrics_prom, args.metrics_json)
+                metrics_due = time.monotonic() + args.metrics_interval
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log("Stopping collector")
+        if subscriber:
+            subscriber.close()
+        executor.shutdown(wait=True, cancel_futures=True)
+        pool.close_all()
+        if parser_pool:
+            parser_pool.shutdown()
+        sink.close()
+        snapshots.close()
+        changes_file.close()
+        if history:
+            history.close()
+        if metrics:
+            metrics.write(args.metrics_prom, args.metrics_json)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Continuously collect BGP peers from Junos devices.")
+    parser.add_argument("--inventory", default="device_inventory.yml",
+                        help="Device inventory file (default: device_inventory.yml)")
+    parser.add_argument("--site", help="Only poll devices at this site")
+    parser.add_argument("--category", help="Only poll devices in this category")
+    parser.add_argument("--tag", action="append", default=[],
+                        help="Only poll devices carrying this inventory tag (repeatable)")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL,
+                        help=f"Default seconds between polls of a device (default: {POLL_INTERVAL})")
+    parser.add_argument("--category-interval", action="append", default=[], metavar="CATEGORY=SECONDS",
+                        help="Poll interval for one category (repeatable)")
+    parser.add_argument("--jitter", type=float, default=JITTER,
+                        help=f"Random spread applied to each interval, as a fraction (default: {JITTER})")
+    parser.add_argument("--subscribe", action="store_true",
+                        help="Subscribe to each device's notifications and re-read only the peers whose "
+                             "state changes, polling in full every --reconcile-interval seconds instead")
+    parser.add_argument("--reconcile-interval", type=float, default=RECONCILE_INTERVAL,
+                        help=f"Seconds between full polls of a device with --subscribe (default: {RECONCILE_INTERVAL})")
+    parser.add_argument("--max-backoff", type=float, default=MAX_BACKOFF,
+                        help=f"Longest delay between retries of a failing device (default: {MAX_BACKOFF})")
+    parser.add_argument("--max-sessions", type=int, default=MAX_SESSIONS,
+                        help=f"Devices polled at the same time (default: {MAX_SESSIONS})")
+    add_governor_args(parser)
+    parser.add_argument("--connect-timeout", type=float, default=CONNECT_TIMEOUT,
+                        help=f"Seconds allowed for each device to connect (default: {CONNECT_TIMEOUT})")
+    parser.add_argument("--rpc-timeout", type=float, default=RPC_TIMEOUT,
+                        help=f"Seconds allowed for each BGP RPC (default: {RPC_TIMEOUT})")
+    parser.add_argument("--fields",
+                        help="Comma-separated peer fields to collect (default: all). If every field is one of "
+                             "peer_address, peer_state, peer_as, flap_count, received_prefixes and "
+                             "active_prefixes, the much smaller BGP summary RPC is used")
+    parser.add_argument("--output", default="bgp_peers.db",
+                        help="Result store; .db/.sqlite or .jsonl (default: bgp_peers.db)")
+    parser.add_argument("--snapshots", default="bgp_snapshots.db",
+                        help="Snapshot database used for change detection (default: bgp_snapshots.db)")
+    parser.add_argument("--changes-file", default="bgp_changes.jsonl",
+                        help="JSON lines file changes are appended to (default: bgp_changes.jsonl)")
+    parser.add_argument("--history",
+                        help="Keep every peer's recent counters in this ring-buffer history file "
+                             "(read it with bgp_timeseries.py)")
+    parser.add_argument("--flap-alert", type=int, metavar="COUNT",
+                        help="With --history, log peers with at least COUNT flaps or state changes "
+                             "within --flap-window seconds")
+    parser.add_argument("--flap-window", type=float, default=FLAP_WINDOW,
+                        help=f"Seconds of history --flap-alert looks at (default: {FLAP_WINDOW})")
+    parser.add_argument("--parse-processes", type=int, default=0,
+                        help="Parse replies in this many worker processes (default: 0, parse in threads)")
+    parser.add_argument("--metrics-prom",
+                        help="Keep per-phase timing histograms in this Prometheus text file")
+    parser.add_argument("--metrics-json",
+                        help="Keep per-phase and per-device timings in this JSON file")
+    parser.add_argument("--metrics-interval", type=float, default=METRICS_INTERVAL,
+                        help=f"Seconds between metrics file updates (default: {METRICS_INTERVAL})")
+    args = parser.parse_args()
+    try:
+        parse_fields(args.fields)
+    except ValueError as e:
+        parser.error(str(e))
+
+    inventory = load_inventory(args.inventory)
+    devices = inventory.select(site=args.site, category=args.category, tags=args.tag)
+    if not devices:
+        print("No matching devices found. Please check your inventory and filters.")
+        exit()
+
+    run_collector(devices, args)
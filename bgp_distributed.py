@@ -0,0 +1,544 @@
+import argparse
+import hmac
+import json
+import os
+import signal
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from bgp_collector import POLL_INTERVAL, log
+from bgp_snapshot import SnapshotStore, format_change
+from bgp_store import open_sink
+from junos_bgp import BgpPeer, fetch_bgp_peers
+from junos_fleet import CONNECT_TIMEOUT, MAX_WORKERS, RPC_TIMEOUT
+from junos_inventory import load_inventory
+from junos_sessions import NetconfSessionPool
+from session_broker import BrokerHandler
+
+# Work queue defaults
+LEASE_SECONDS = 120
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 30
+IDLE_WAIT = 2
+
+# Networked queue defaults
+QUEUE_PORT = 7600
+QUEUE_TIMEOUT = 30
+# Shared secret remote workers must present, if the coordinator sets one
+QUEUE_TOKEN = os.environ.get("BGP_QUEUE_TOKEN")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    round INTEGER NOT NULL,
+    host TEXT NOT NULL,
+    site TEXT,
+    category TEXT,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    error TEXT,
+    enqueued_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_state ON tasks (state, lease_until);
+CREATE INDEX IF NOT EXISTS idx_tasks_host ON tasks (host, state);
+CREATE TABLE IF NOT EXISTS results (
+    task_id INTEGER PRIMARY KEY,
+    host TEXT NOT NULL,
+    worker TEXT NOT NULL,
+    collected_at REAL NOT NULL,
+    peers BLOB NOT NULL
+);
+"""
+
+
+class QueueError(Exception):
+    """Raised on a remote worker when the queue server reports a failure."""
+
+
+# Failures of a queue call a worker survives: its leases expire and are handed out again
+QUEUE_ERRORS = (OSError, QueueError, sqlite3.Error)
+
+
+class WorkQueue:
+    """
+    Durable queue of per-device collection tasks in an SQLite file.
+
+    Workers lease tasks for lease_seconds and must finish or renew them
+    in time. A lease that runs out (the worker crashed or hung) makes the
+    task available again, and a failed task is retried after a growing
+    delay, until it has been tried max_attempts times.
+    Tasks carry only the host, never credentials: each worker looks the
+    device up in its own inventory.
+    """
+
+    def __init__(self, path, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def _transaction(self, func, *args):
+        """
+        Run func(*args) in a write transaction so concurrent workers never
+        lease the same task.
+        """
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(*args)
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+            return result
+
+    def enqueue(self, devices, round_id):
+        """
+        Queue a task per device, skipping devices whose previous task is
+        still waiting or running. Returns the number queued.
+        """
+        def insert():
+            busy = {host for host, in self.conn.execute(
+                "SELECT DISTINCT host FROM tasks WHERE state IN ('pending', 'leased')"
+            )}
+            rows = [
+                (round_id, device["host"], device.get("site"), device.get("category"), time.time())
+                for device in devices if device["host"] not in busy
+            ]
+            self.conn.executemany(
+                "INSERT INTO tasks (round, host, site, category, enqueued_at) VALUES (?, ?, ?, ?, ?)", rows
+            )
+            return len(rows)
+        return self._transaction(insert)
+
+    def lease(self, worker, count):
+        """
+        Lease up to count tasks that are pending or whose lease expired.
+        """
+        def claim():
+            now = time.time()
+            # Expired leases that used their last attempt give up for good
+            self.conn.execute(
+                "UPDATE tasks SET state = 'failed', error = 'lease expired', finished_at = ? "
+                "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            rows = self.conn.execute(
+                "SELECT id, host, site, category FROM tasks "
+                "WHERE state IN ('pending', 'leased') AND COALESCE(lease_until, 0) < ? ORDER BY id LIMIT ?",
+                (now, count),
+            ).fetchall()
+            self.conn.executemany(
+                "UPDATE tasks SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1 "
+                "WHERE id = ?",
+                [(worker, now + self.lease_seconds, row[0]) for row in rows],
+            )
+            return [{"id": row[0], "host": row[1], "site": row[2], "category": row[3]} for row in rows]
+        return self._transaction(claim)
+
+    def renew(self, worker, task_ids):
+        """
+        Extend this worker's leases on task_ids.
+        """
+        with self._lock:
+            self.conn.executemany(
+                "UPDATE tasks SET lease_until = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+                [(time.time() + self.lease_seconds, task_id, worker) for task_id in task_ids],
+            )
+
+    def complete(self, task_id, worker, host, peers):
+        """
+        Store a task's peers. Returns False if the lease was lost to
+        another worker, in which case the result is dropped.
+        """
+        payload = zlib.compress(json.dumps([peer.astuple() for peer in peers]).encode())
+
+        def finish():
+            now = time.time()
+            updated = self.conn.execute(
+                "UPDATE tasks SET state = 'done', finished_at = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+                (now, task_id, worker),
+            ).rowcount
+            if updated:
+                self.conn.execute(
+                    "INSERT INTO results (task_id, host, worker, collected_at, peers) VALUES (?, ?, ?, ?, ?)",
+                    (task_id, host, worker, now, payload),
+                )
+            return bool(updated)
+        return self._transaction(finish)
+
+    def fail(self, task_id, worker, error):
+        """
+        Give a failed task back to the queue after retry_delay seconds per
+        attempt so far, or mark it failed once it has used all its attempts.
+        """
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "error = ?, worker = NULL, lease_until = ? + attempts * ?, finished_at = ? "
+                "WHERE id = ? AND worker = ? AND state = 'leased'",
+                (self.max_attempts, str(error), now, self.retry_delay, now, task_id, worker),
+            )
+
+    def take_results(self, limit=500):
+        """
+        Remove and return up to limit finished results as (host, peers).
+        """
+        def take():
+            rows = self.conn.execute(
+                "SELECT task_id, host, peers FROM results ORDER BY task_id LIMIT ?", (limit,)
+            ).fetchall()
+            self.conn.executemany("DELETE FROM results WHERE task_id = ?", [(row[0],) for row in rows])
+            return rows
+        return [
+            (host, [BgpPeer.from_tuple(host, row) for row in json.loads(zlib.decompress(payload))])
+            for _, host, payload in self._transaction(take)
+        ]
+
+    def take_failures(self, since_id):
+        """
+        Return (id, host, error) for tasks that failed for good after since_id.
+        """
+        with self._lock:
+            return self.conn.execute(
+                "SELECT id, host, error FROM tasks WHERE state = 'failed' AND id > ? ORDER BY id", (since_id,)
+            ).fetchall()
+
+    def counts(self):
+        with self._lock:
+            return dict(self.conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+
+    def prune(self, older_than):
+        """
+        Forget finished tasks that ended more than older_than seconds ago.
+        """
+        with self._lock:
+            self.conn.execute(
+                "DELETE FROM tasks WHERE state IN ('done', 'failed') AND finished_at < ?",
+                (time.time() - older_than,),
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+class QueueServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    Serve the worker side of a local WorkQueue over TCP.
+
+    SQLite's WAL mode needs shared memory, so the queue file only works
+    for processes on one host. Workers on other nodes reach it through
+    the coordinator instead, with the broker's JSON-line protocol.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, queue, token=QUEUE_TOKEN):
+        self.queue = queue
+        self.token = token
+        super().__init__(address, BrokerHandler)
+
+    def dispatch(self, request):
+        if self.token and not hmac.compare_digest(str(request.get("token")), self.token):
+            raise PermissionError("Bad queue token")
+        op = request.get("op")
+        if op == "lease":
+            return {"tasks": self.queue.lease(request["worker"], request["count"])}
+        if op == "renew":
+            self.queue.renew(request["worker"], request["task_ids"])
+            return {}
+        if op == "complete":
+            host = request["host"]
+            peers = [BgpPeer.from_tuple(host, row) for row in request["peers"]]
+            return {"stored": self.queue.complete(request["task_id"], request["worker"], host, peers)}
+        if op == "fail":
+            self.queue.fail(request["task_id"], request["worker"], request["error"])
+            return {}
+        raise ValueError(f"Unknown queue operation '{op}'")
+
+
+class RemoteQueue:
+    """
+    Worker side of a WorkQueue served by a coordinator's QueueServer.
+
+    Offers the same lease, renew, complete and fail calls as WorkQueue
+    over one kept-open connection, reconnecting once if it dropped.
+    """
+
+    def __init__(self, address, token=QUEUE_TOKEN, timeout=QUEUE_TIMEOUT):
+        self.address = address
+        self.token = token
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock = None
+        self._file = None
+
+    def _disconnect(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = self._file = None
+
+    def _call(self, request):
+        data = json.dumps({**request, "token": self.token}).encode() + b"\n"
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._sock = socket.create_connection(self.address, timeout=self.timeout)
+                        self._file = self._sock.makefile("rb")
+                    self._sock.sendall(data)
+                    line = self._file.readline()
+                    if not line:
+                        raise ConnectionError("Queue server closed the connection")
+                    break
+                except OSError:
+                    self._disconnect()
+                    if attempt:
+                        raise
+        response = json.loads(line)
+        if not response.pop("ok"):
+            raise QueueError(response.get("error"))
+        return response
+
+    def lease(self, worker, count):
+        return self._call({"op": "lease", "worker": worker, "count": count})["tasks"]
+
+    def renew(self, worker, task_ids):
+        self._call({"op": "renew", "worker": worker, "task_ids": task_ids})
+
+    def complete(self, task_id, worker, host, peers):
+        return self._call({
+            "op": "complete", "task_id": task_id, "worker": worker, "host": host,
+            "peers": [peer.astuple() for peer in peers],
+        })["stored"]
+
+    def fail(self, task_id, worker, error):
+        self._call({"op": "fail", "task_id": task_id, "worker": worker, "error": str(error)})
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+
+def parse_address(text, default_port=QUEUE_PORT):
+    """
+    Split "host:port" (or just "host") into a (host, port) tuple.
+    """
+    host, _, port = text.rpartition(":") if ":" in text else (text, "", "")
+    return host.strip("[]"), int(port) if port else default_port
+
+
+def open_queue(spec, args):
+    """
+    Open the work queue named by spec: tcp://HOST:PORT for a coordinator's
+    QueueServer, anything else for an SQLite file on this host.
+    """
+    if spec.startswith("tcp://"):
+        return RemoteQueue(parse_address(spec[len("tcp://"):]), timeout=args.rpc_timeout)
+    return WorkQueue(spec, args.lease_seconds, args.max_attempts, args.retry_delay)
+
+
+def run_coordinator(devices, args):
+    """
+    Queue every device once per interval and store what the workers return.
+    """
+    queue = WorkQueue(args.queue, args.lease_seconds, args.max_attempts, args.retry_delay)
+    server = None
+    if args.listen:
+        server = QueueServer(parse_address(args.listen), queue)
+        threading.Thread(target=server.serve_forever, name="queue-server", daemon=True).start()
+        log(f"Serving the queue to remote workers on {args.listen}")
+    sink = open_sink(args.output)
+    snapshots = SnapshotStore(args.snapshots)
+    changes_file = open(args.changes_file, "a")
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+
+    round_id = 0
+    next_round = time.monotonic()
+    last_failure = 0
+    log(f"Coordinating {len(devices)} device(s) through {args.queue}")
+    try:
+        while not stopping:
+            if time.monotonic() >= next_round:
+                round_id += 1
+                queued = queue.enqueue(devices, round_id)
+                queue.prune(args.interval * 10)
+                log(f"Round {round_id}: queued {queued} device(s), queue {queue.counts()}")
+                next_round += args.interval
+
+            results = queue.take_results()
+            for host, peers in results:
+                try:
+                    sink.write(host, peers)
+                    for change in snapshots.diff(host, peers):
+                        log(format_change(host, change))
+                        changes_file.write(json.dumps({"time": time.time(), "device": host, **change}) + "\n")
+                except Exception as e:
+                    log(f"Error storing {host}: {e}")
+            if results:
+                sink.flush()
+                changes_file.flush()
+
+            for task_id, host, error in queue.take_failures(last_failure):
+                log(f"Giving up on {host} after {args.max_attempts} attempt(s): {error}")
+                last_failure = task_id
+
+            if not results:
+                time.sleep(IDLE_WAIT)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log("Stopping coordinator")
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        sink.close()
+        snapshots.close()
+        changes_file.close()
+        queue.close()
+
+
+def run_worker(inventory, args):
+    """
+    Lease tasks, collect their devices and push the peers back, until stopped.
+    """
+    worker = args.worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    queue = open_queue(args.queue, args)
+    pool = NetconfSessionPool(
+        idle_timeout=POLL_INTERVAL * 2 + 60,
+        connect_timeout=args.connect_timeout,
+        rpc_timeout=args.rpc_timeout,
+    )
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+    leased = set()
+
+    def heartbeat():
+        # Renew leases at a third of their length while tasks run
+        while not stopping:
+            time.sleep(args.lease_seconds / 3)
+            if leased:
+                try:
+                    queue.renew(worker, list(leased))
+                except QUEUE_ERRORS as e:
+                    log(f"Could not renew leases: {e}")
+
+    def collect(task):
+        # The same host may be listed under several sites with other credentials
+        devices = inventory.select(site=task["site"], category=task["category"], hosts=[task["host"]])
+        if not devices:
+            raise LookupError(f"{task['host']} is not in this worker's inventory")
+        return list(fetch_bgp_peers(pool, devices[0]))
+
+    def report(task, future):
+        error = future.exception()
+        if error:
+            log(f"Error polling {task['host']}: {error}")
+            queue.fail(task["id"], worker, error)
+        elif not queue.complete(task["id"], worker, task["host"], future.result()):
+            log(f"Lease on {task['host']} was lost; result dropped")
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+    log(f"Worker {worker} serving {args.queue}")
+    inflight = {}
+    try:
+        with ThreadPoolExecutor(max_workers=args.max_sessions) as executor:
+            # Lease a new task whenever a session frees up, so one slow
+            # device never holds the others' slots idle
+            while inflight or not stopping:
+                free = args.max_sessions - len(inflight)
+                if free and not stopping:
+                    try:
+                        tasks = queue.lease(worker, free)
+                    except QUEUE_ERRORS as e:
+                        log(f"Could not lease tasks: {e}")
+                        tasks = []
+                    for task in tasks:
+                        leased.add(task["id"])
+                        inflight[executor.submit(collect, task)] = task
+                if not inflight:
+                    time.sleep(IDLE_WAIT)
+                    continue
+                done, _ = wait(inflight, timeout=IDLE_WAIT, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = inflight.pop(future)
+                    leased.discard(task["id"])
+                    try:
+                        report(task, future)
+                    except QUEUE_ERRORS as e:
+                        log(f"Could not report {task['host']}; its lease will expire: {e}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log(f"Stopping worker {worker}")
+        stopping.append(True)
+        pool.close_all()
+        queue.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collect BGP peers with a coordinator and any number of workers.")
+    parser.add_argument("role", choices=("coordinator", "worker"), help="Run the coordinator or a worker")
+    parser.add_argument("--queue", default="bgp_queue.db",
+                        help="Work queue: an SQLite file on this host, or for workers tcp://HOST:PORT of a "
+                             "coordinator started with --listen (default: bgp_queue.db)")
+    parser.add_argument("--listen", metavar="HOST:PORT",
+                        help=f"Coordinator: also serve the queue to workers on other nodes (default port: "
+                             f"{QUEUE_PORT}; set BGP_QUEUE_TOKEN on both sides to require a shared secret)")
+    parser.add_argument("--inventory", default="device_inventory.yml",
+                        help="Device inventory file (default: device_inventory.yml)")
+    parser.add_argument("--site", help="Coordinator: only queue devices at this site")
+    parser.add_argument("--category", help="Coordinator: only queue devices in this category")
+    parser.add_argument("--tag", action="append", default=[],
+                        help="Coordinator: only queue devices carrying this inventory tag (repeatable)")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL,
+                        help=f"Coordinator: seconds between collection rounds (default: {POLL_INTERVAL})")
+    parser.add_argument("--lease-seconds", type=float, default=LEASE_SECONDS,
+                        help=f"Seconds a worker holds a task before it is handed out again (default: {LEASE_SECONDS})")
+    parser.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS,
+                        help=f"Tries per device and round before giving up (default: {MAX_ATTEMPTS})")
+    parser.add_argument("--retry-delay", type=float, default=RETRY_DELAY,
+                        help=f"Seconds per attempt so far before a failed device is retried (default: {RETRY_DELAY})")
+    parser.add_argument("--output", default="bgp_peers.db",
+                        help="Coordinator: result store; .db/.sqlite or .jsonl (default: bgp_peers.db)")
+    parser.add_argument("--snapshots", default="bgp_snapshots.db",
+                        help="Coordinator: snapshot database used for change detection (default: bgp_snapshots.db)")
+    parser.add_argument("--changes-file", default="bgp_changes.jsonl",
+                        help="Coordinator: JSON lines file changes are appended to (default: bgp_changes.jsonl)")
+    parser.add_argument("--worker-id", help="Worker: name recorded on leases (default: hostname:pid)")
+    parser.add_argument("--max-sessions", type=int, default=MAX_WORKERS,
+                        help=f"Worker: devices polled at the same time (default: {MAX_WORKERS})")
+    parser.add_argument("--connect-timeout", type=float, default=CONNECT_TIMEOUT,
+                        help=f"Worker: seconds allowed for each device to connect (default: {CONNECT_TIMEOUT})")
+    parser.add_argument("--rpc-timeout", type=float, default=RPC_TIMEOUT,
+                        help=f"Worker: seconds allowed for each BGP RPC (default: {RPC_TIMEOUT})")
+    args = parser.parse_args()
+
+    inventory = load_inventory(args.inventory)
+    if args.role == "worker":
+        run_worker(inventory, args)
+        exit()
+
+    if args.queue.startswith("tcp://"):
+        parser.error("the coordinator owns the queue: give it a file and use --listen for remote workers")
+    devices = inventory.select(site=args.site, category=args.category, tags=args.tag)
+    if not devices:
+        print("No matching devices found. Please check your inventory and filters.")
+        exit()
+    run_coordinator(devices, args)
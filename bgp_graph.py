@@ -0,0 +1,266 @@
+import argparse
+import json
+import time
+from collections import Counter
+
+from bgp_index import load_index
+from junos_bgp import pack_address, unpack_address
+
+# Row positions in PeerIndex.rows (BgpPeer slot order)
+DEVICE, PEER_IP, LOCAL_IP, PEER_STATE = 0, 1, 2, 3
+PEER_AS, LOCAL_AS = 9, 10
+
+# Mismatch kinds, in report order
+MISMATCHES = ("one_sided", "address_mismatch", "asymmetric_state", "as_mismatch")
+
+
+def read_addresses(path):
+    """
+    Yield (device, packed address) from an addresses.jsonl file written by
+    get_device_data.py --collect addresses.
+    """
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                address = record.get("address", "").partition("/")[0]
+                if record.get("device") and address:
+                    yield record["device"], pack_address(address)
+
+
+class DisjointSet:
+    """
+    Union-find over hashable items, with path halving and union by size.
+    """
+
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def add(self, item):
+        if item not in self.parent:
+            self.parent[item] = item
+            self.size[item] = 1
+
+    def find(self, item):
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size.pop(b)
+
+    def groups(self):
+        """
+        Return every set as a list of items, largest first.
+        """
+        groups = {}
+        for item in self.parent:
+            groups.setdefault(self.find(item), []).append(item)
+        return sorted(groups.values(), key=len, reverse=True)
+
+
+class AdjacencyGraph:
+    """
+    BGP sessions of a fleet matched end to end.
+
+    Both ends of a session are paired with a hash join: every session is
+    keyed by (local address, peer address) and probed with the reverse
+    key, so a million peers pair up in one pass instead of comparing each
+    against all the others. A session whose peer address belongs to a
+    collected device (one of its local or interface addresses) but finds
+    no reverse entry is reported as one-sided, or as an address mismatch
+    if that device does have an unmatched session back. A session with no
+    local address, as Junos often reports for one that never came up, is
+    paired with the far end's session toward its device if there is one
+    and reported as one-sided otherwise.
+
+    pairs holds (row, row) for matched sessions, mismatches maps each kind
+    in MISMATCHES to (row, other row or None), and components lists the
+    devices linked by sessions between collected devices, largest first.
+    """
+
+    def __init__(self, index, addresses=()):
+        self.index = index
+        rows = index.rows
+
+        # Which device owns each address; an address claimed twice is ambiguous
+        self.owners = {}
+        self.conflicts = set()
+        claims = ((row[DEVICE], row[LOCAL_IP]) for row in rows)
+        for device, address in (*claims, *addresses):
+            if address is None:
+                continue
+            owner = self.owners.setdefault(address, device)
+            if owner != device:
+                self.conflicts.add(address)
+        for address in self.conflicts:
+            del self.owners[address]
+
+        # Build side of the join, plus (local address, device it peers with)
+        # for sessions whose far end reported no local address
+        sessions = {}
+        toward = {}
+        for number, row in enumerate(rows):
+            if row[LOCAL_IP] is not None and row[PEER_IP] is not None:
+                sessions[row[LOCAL_IP], row[PEER_IP]] = number
+                remote = self.owners.get(row[PEER_IP])
+                if remote is not None:
+                    toward.setdefault((row[LOCAL_IP], remote), number)
+
+        self.pairs = []
+        self.mismatches = {kind: [] for kind in MISMATCHES}
+        self.external = 0
+        self.unkeyed = 0
+        unmatched = {}
+        paired = set()
+        components = DisjointSet()
+
+        # Probe side: each session looks up its reverse
+        for number, row in enumerate(rows):
+            device = row[DEVICE]
+            components.add(device)
+            if row[PEER_IP] is None:
+                self.unkeyed += 1
+                continue
+            if row[LOCAL_IP] is None:
+                remote = self.owners.get(row[PEER_IP])
+                if remote is None:
+                    self.external += 1
+                    continue
+                components.add(remote)
+                components.union(device, remote)
+                other = toward.pop((row[PEER_IP], device), None)
+                if other is not None and (rows[other][PEER_IP], rows[other][LOCAL_IP]) in sessions:
+                    other = None
+                if other is None:
+                    self.mismatches["one_sided"].append((number, None))
+                else:
+                    self._check_pair(number, other)
+                    paired.add(other)
+                continue
+            other = sessions.get((row[PEER_IP], row[LOCAL_IP]))
+            if other is not None:
+                if number < other:
+                    self._check_pair(number, other)
+                    components.add(rows[other][DEVICE])
+                    components.union(device, rows[other][DEVICE])
+                continue
+            remote = self.owners.get(row[PEER_IP])
+            if remote is None:
+                self.external += 1
+                continue
+            components.add(remote)
+            components.union(device, remote)
+            unmatched.setdefault((device, remote), []).append(number)
+
+        # Unmatched sessions both ways between two devices disagree on addresses
+        for key, numbers in unmatched.items():
+            unmatched[key] = [number for number in numbers if number not in paired]
+        for (device, remote), numbers in unmatched.items():
+            reverse = unmatched.get((remote, device), ())
+            for position, number in enumerate(numbers):
+                if position < len(reverse):
+                    if device < remote:
+                        self.mismatches["address_mismatch"].append((number, reverse[position]))
+                else:
+                    self.mismatches["one_sided"].append((number, None))
+
+        self.components = components.groups()
+
+    def _check_pair(self, a, b):
+        rows = self.index.rows
+        self.pairs.append((a, b))
+        if rows[a][PEER_STATE] != rows[b][PEER_STATE]:
+            self.mismatches["asymmetric_state"].append((a, b))
+        # Each end's peer AS should be the other end's local AS (unknown if not collected)
+        for near, far in ((rows[a], rows[b]), (rows[b], rows[a])):
+            if near[PEER_AS] is not None and far[LOCAL_AS] is not None and near[PEER_AS] != far[LOCAL_AS]:
+                self.mismatches["as_mismatch"].append((a, b))
+                break
+
+    def summary(self):
+        return {
+            "sessions": len(self.index),
+            "matched_pairs": len(self.pairs),
+            "external": self.external,
+            "unkeyed": self.unkeyed,
+            "ambiguous_addresses": len(self.conflicts),
+            **{kind: len(found) for kind, found in self.mismatches.items()},
+            "components": len(self.components),
+            "largest_component": len(self.components[0]) if self.components else 0,
+        }
+
+
+def format_session(row):
+    return (
+        f"{row[DEVICE]} {unpack_address(row[LOCAL_IP]) or '-'} -> {unpack_address(row[PEER_IP]) or '-'} "
+        f"AS{row[PEER_AS] or '-'} {row[PEER_STATE] or '-'}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pair both ends of BGP sessions across the fleet and report mismatches.")
+    parser.add_argument("--source", default="bgp_peers.db",
+                        help="Result file written by get_bgp_peers.py (default: bgp_peers.db)")
+    parser.add_argument("--addresses",
+                        help="addresses.jsonl from get_device_data.py --collect addresses, so sessions to "
+                             "interface addresses are attributed to their device")
+    parser.add_argument("--show", type=int, default=10, help="Sessions listed per mismatch kind (default: 10)")
+    parser.add_argument("--json", help="Also write the summary, mismatches and components to this JSON file")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the peer index even if it is current")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = load_index(args.source, rebuild=args.rebuild)
+    addresses = list(read_addresses(args.addresses)) if args.addresses else ()
+    graph = AdjacencyGraph(index, addresses)
+    elapsed = time.perf_counter() - start
+
+    rows = index.rows
+    summary = graph.summary()
+    print(f"Graph over {summary['sessions']} sessions built in {elapsed:.2f}s")
+    for key, value in summary.items():
+        print(f"  {key}: {value}")
+
+    for kind in MISMATCHES:
+        found = graph.mismatches[kind]
+        if not found:
+            continue
+        print(f"\n{kind} ({len(found)}):")
+        for number, other in found[:args.show]:
+            line = format_session(rows[number])
+            if other is not None:
+                line += f"  <->  {format_session(rows[other])}"
+            print(f"  {line}")
+
+    sizes = Counter(len(component) for component in graph.components)
+    print("\nComponents by size: " + ", ".join(f"{count} x {size}" for size, count in sorted(sizes.items(), reverse=True)))
+
+    if args.json:
+        def session(number):
+            return None if number is None else {
+                "device": rows[number][DEVICE],
+                "local_address": unpack_address(rows[number][LOCAL_IP]),
+                "peer_address": unpack_address(rows[number][PEER_IP]),
+                "peer_state": rows[number][PEER_STATE],
+            }
+
+        with open(args.json, "w") as f:
+            json.dump({
+                "summary": summary,
+                "mismatches": {
+                    kind: [[session(number), session(other)] for number, other in found]
+                    for kind, found in graph.mismatches.items()
+                },
+                "components": graph.components,
+            }, f, indent=2)
+        print(f"Wrote {args.json}")
@@ -0,0 +1,239 @@
+import argparse
+import bisect
+import ipaddress
+import json
+import os
+import pickle
+import sqlite3
+import time
+from array import array
+
+from junos_bgp import IPV6_FLAG, BgpPeer, pack_address
+from junos_inventory import save_cache
+
+# Bump when the index layout changes so stale index files are rebuilt
+INDEX_VERSION = 1
+
+# Columns read back from the result store, in BgpPeer slot order
+INDEX_COLUMNS = (
+    "device", "peer_address", "local_address", "peer_state", "peer_type", "peer_group",
+    "description", "received_prefixes", "active_prefixes", "peer_as", "local_as", "flap_count",
+)
+
+
+def read_peers(path):
+    """
+    Yield BgpPeer-ordered tuples from a .db/.sqlite or .jsonl result file.
+    """
+    if path.endswith(".jsonl"):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield tuple(record.get(column) for column in INDEX_COLUMNS)
+        return
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        yield from conn.execute(f"SELECT {', '.join(INDEX_COLUMNS)} FROM bgp_peers")
+    finally:
+        conn.close()
+
+
+def network_range(prefix):
+    """
+    Return the (first, last) packed addresses covered by a CIDR prefix.
+    """
+    network = ipaddress.ip_network(prefix, strict=False)
+    flag = IPV6_FLAG if network.version == 6 else 0
+    return int(network.network_address) | flag, int(network.broadcast_address) | flag
+
+
+class PeerIndex:
+    """
+    Lookup structures over a set of collected BGP peers.
+
+    Peers are kept as compact tuples and addressed by row number. Hash
+    indexes map ASN, device and state to row numbers. Peer addresses are
+    held as a sorted array of packed ints: that is the leaf order of a
+    binary radix trie, so containment is a bisect over the prefix's range
+    and the longest matching prefix is found next to the query address,
+    both in O(log n) without a million trie nodes to build or pickle.
+    """
+
+    def __init__(self, rows):
+        self.rows = []
+        self.by_asn = {}
+        self.by_device = {}
+        self.by_state = {}
+        keyed = []
+
+        for row in rows:
+            device, peer_address, local_address, *rest = row
+            peer_ip = pack_address(peer_address)
+            number = len(self.rows)
+            self.rows.append((device, peer_ip, pack_address(local_address), *rest))
+            peer_state, peer_as = rest[0], rest[6]
+            self.by_asn.setdefault(peer_as, []).append(number)
+            self.by_device.setdefault(device, []).append(number)
+            self.by_state.setdefault(peer_state, []).append(number)
+            if peer_ip is not None:
+                keyed.append((peer_ip, number))
+
+        keyed.sort()
+        self.addresses = [address for address, _ in keyed]
+        self.address_rows = array("L", (number for _, number in keyed))
+        for index in (self.by_asn, self.by_device, self.by_state):
+            for key, numbers in index.items():
+                index[key] = array("L", numbers)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def peer(self, number):
+        return BgpPeer(*self.rows[number])
+
+    def within(self, prefix):
+        """
+        Return the row numbers of peers whose address falls inside prefix.
+        """
+        first, last = network_range(prefix)
+        start = bisect.bisect_left(self.addresses, first)
+        end = bisect.bisect_right(self.addresses, last, lo=start)
+        return self.address_rows[start:end]
+
+    def longest_match(self, address):
+        """
+        Return (network, row numbers) for the most specific prefix that
+        contains address and at least one peer address.
+
+        The peer sharing the longest prefix with address always sits on
+        either side of its insertion point in the sorted array.
+        """
+        packed = pack_address(address)
+        if packed is None:
+            raise ValueError(f"Not an IP address: {address}")
+        bits = 128 if packed & IPV6_FLAG else 32
+        position = bisect.bisect_left(self.addresses, packed)
+        best = -1
+        for neighbour in self.addresses[max(position - 1, 0):position + 1]:
+            if (neighbour ^ packed) & IPV6_FLAG:
+                continue
+            best = max(best, bits - (neighbour ^ packed).bit_length())
+        if best < 0:
+            return None, array("L")
+        network = ipaddress.ip_network(f"{address}/{best}", strict=False)
+        return network, self.within(str(network))
+
+    def query(self, asn=None, device=None, state=None, prefix=None):
+        """
+        Return the peers matching every given filter, in row order.
+
+        The smallest candidate set drives the scan, as in
+        CompiledInventory.select(); the other filters are checked against
+        each candidate row, so no large set is ever built.
+        """
+        candidates, checks = [], []
+        if asn is not None:
+            candidates.append(self.by_asn.get(asn, ()))
+            checks.append(lambda row: row[9] == asn)
+        if device is not None:
+            candidates.append(self.by_device.get(device, ()))
+            checks.append(lambda row: row[0] == device)
+        if state is not None:
+            candidates.append(self.by_state.get(state, ()))
+            checks.append(lambda row: row[3] == state)
+        if prefix is not None:
+            first, last = network_range(prefix)
+            candidates.append(self.within(prefix))
+            checks.append(lambda row: row[1] is not None and first <= row[1] <= last)
+
+        if not candidates:
+            return [self.peer(number) for number in range(len(self.rows))]
+
+        smallest = min(candidates, key=len)
+        rows = self.rows
+        return [
+            BgpPeer(*rows[number]) for number in sorted(smallest)
+            if all(check(rows[number]) for check in checks)
+        ]
+
+
+def source_stamp(path):
+    """
+    Stamp a result file (and its SQLite WAL, if any) by mtime and size.
+    """
+    stamp = []
+    for name in (path, f"{path}-wal"):
+        try:
+            stat = os.stat(name)
+        except FileNotFoundError:
+            continue
+        stamp.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(stamp)
+
+
+def load_index(path, index_path=None, rebuild=False):
+    """
+    Return a PeerIndex over the result file at path.
+
+    The index is persisted next to the results and reused for as long as
+    the result file is unchanged.
+    """
+    index_path = index_path or f"{path}.idx"
+    stamp = source_stamp(path)
+    if not stamp:
+        raise FileNotFoundError(path)
+
+    if not rebuild:
+        try:
+            with open(index_path, "rb") as f:
+                cached = pickle.load(f)
+            if cached.get("version") == INDEX_VERSION and cached["stamp"] == stamp:
+                return cached["index"]
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+            pass
+
+    index = PeerIndex(read_peers(path))
+    try:
+        save_cache(index_path, {"version": INDEX_VERSION, "stamp": stamp, "index": index})
+    except OSError as e:
+        print(f"Warning: could not write peer index {index_path}: {e}")
+    return index
+
+
+def format_peer(peer):
+    return (
+        f"{peer.device:<20} {peer.peer_address or '-':<40} AS{peer.peer_as or '-':<10} "
+        f"{peer.peer_state or '-':<12} {peer.received_prefixes or 0:>8} received"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query collected BGP peers by address prefix, ASN and state.")
+    parser.add_argument("--source", default="bgp_peers.db",
+                        help="Result file written by get_bgp_peers.py (default: bgp_peers.db)")
+    parser.add_argument("--asn", type=int, help="Only peers in this AS")
+    parser.add_argument("--device", help="Only peers of this device")
+    parser.add_argument("--state", help="Only peers in this state, e.g. Established")
+    parser.add_argument("--prefix", help="Only peers whose address is inside this prefix, e.g. 10.20.0.0/16")
+    parser.add_argument("--longest-match", metavar="ADDRESS",
+                        help="Show the peers under the longest prefix matching this address")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the index even if it is current")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = load_index(args.source, rebuild=args.rebuild)
+    print(f"Index over {len(index)} peers ready in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    start = time.perf_counter()
+    if args.longest_match:
+        network, numbers = index.longest_match(args.longest_match)
+        peers = [index.peer(number) for number in numbers]
+        print(f"Longest match: {network or 'none'}")
+    else:
+        peers = index.query(asn=args.asn, device=args.device, state=args.state, prefix=args.prefix)
+    elapsed = time.perf_counter() - start
+
+    for peer in peers:
+        print(format_peer(peer))
+    print(f"{len(peers)} matching peer(s) in {elapsed * 1000:.3f}ms")
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+# Fields whose change is reported as a delta
+TRACKED_FIELDS = ("peer_state", "received_prefixes", "active_prefixes")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bgp_snapshots (
+    device TEXT NOT NULL,
+    peer_key TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    fields TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (device, peer_key)
+);
+"""
+
+
+def peer_key(peer):
+    """
+    Identify a session within its device by peer and local address and,
+    outside the master instance, routing instance. Master-instance keys
+    keep their old form so existing snapshots still match.
+    """
+    key = f"{peer.get('peer_address')}|{peer.get('local_address') or ''}"
+    instance = peer.get("routing_instance")
+    return f"{key}|{instance}" if instance and instance != "master" else key
+
+
+def peer_digest(peer):
+    """
+    Return a stable hash of the tracked fields of a peer.
+    """
+    values = "|".join(str(peer.get(field)) for field in TRACKED_FIELDS)
+    return hashlib.blake2b(values.encode(), digest_size=8).hexdigest()
+
+
+def diff_peers(previous, peers):
+    """
+    Compare a device's previous snapshot with freshly collected peers.
+
+    previous maps peer_key -> (digest, fields). Only peers whose digest
+    differs are inspected field by field, so the cost is O(peers).
+    Returns a list of change dicts with change in added, removed, state
+    or prefixes.
+    """
+    changes = []
+    seen = set()
+    for peer in peers:
+        key = peer_key(peer)
+        seen.add(key)
+        old = previous.get(key)
+        if old is None:
+            changes.append({"change": "added", "peer": key, "new": tracked(peer)})
+            continue
+
+        old_digest, old_fields = old
+        if old_digest == peer_digest(peer):
+            continue
+        new_fields = tracked(peer)
+        change = "state" if old_fields.get("peer_state") != new_fields["peer_state"] else "prefixes"
+        changes.append({"change": change, "peer": key, "old": old_fields, "new": new_fields})
+
+    for key, (_, old_fields) in previous.items():
+        if key not in seen:
+            changes.append({"change": "removed", "peer": key, "old": old_fields})
+    return changes
+
+
+def tracked(peer):
+    return {field: peer.get(field) for field in TRACKED_FIELDS}
+
+
+class SnapshotStore:
+    """
+    Last known peer state per device, kept in SQLite.
+    """
+
+    def __init__(self, path="bgp_snapshots.db"):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def load(self, device):
+        """
+        Return the stored snapshot for device as peer_key -> (digest, fields).
+        """
+        rows = self.conn.execute(
+            "SELECT peer_key, digest, fields FROM bgp_snapshots WHERE device = ?", (device,)
+        )
+        return {key: (digest, json.loads(fields)) for key, digest, fields in rows}
+
+    def save(self, device, peers):
+        """
+        Replace the stored snapshot for device with peers.
+        """
+        now = time.time()
+        rows = [
+            (device, peer_key(peer), peer_digest(peer), json.dumps(tracked(peer)), now)
+            for peer in peers
+        ]
+        with self.conn:
+            self.conn.execute("DELETE FROM bgp_snapshots WHERE device = ?", (device,))
+            self.conn.executemany("INSERT INTO bgp_snapshots VALUES (?, ?, ?, ?, ?)", rows)
+
+    def diff(self, device, peers):
+        """
+        Diff peers against the stored snapshot, storing them if anything changed.
+        """
+        changes = diff_peers(self.load(device), peers)
+        if changes:
+            self.save(device, peers)
+        return changes
+
+    def update(self, device, peers):
+        """
+        Diff and store only the given peers, leaving the rest of the
+        device's snapshot alone. Peers missing from peers are not removed.
+        """
+        if not peers:
+            return []
+        keys = [peer_key(peer) for peer in peers]
+        rows = self.conn.execute(
+            f"SELECT peer_key, digest, fields FROM bgp_snapshots "
+            f"WHERE device = ? AND peer_key IN ({', '.join('?' * len(keys))})",
+            (device, *keys),
+        )
+        changes = diff_peers({key: (digest, json.loads(fields)) for key, digest, fields in rows}, peers)
+        if changes:
+            now = time.time()
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO bgp_snapshots VALUES (?, ?, ?, ?, ?)",
+                    [(device, key, peer_digest(peer), json.dumps(tracked(peer)), now)
+                     for key, peer in zip(keys, peers)],
+                )
+        return changes
+
+    def close(self):
+        self.conn.close()
+
+
+def format_change(device, change):
+    """
+    Format a change as a one-line report.
+    """
+    if change["change"] == "added":
+        return f"{device} + {change['peer']} {change['new']['peer_state']}"
+    if change["change"] == "removed":
+        return f"{device} - {change['peer']} (was {change['old']['peer_state']})"
+    old, new = change["old"], change["new"]
+    if change["change"] == "state":
+        return f"{device} ~ {change['peer']} {old['peer_state']} -> {new['peer_state']}"
+    return (
+        f"{device} ~ {change['peer']} prefixes "
+        f"{old['received_prefixes']} -> {new['received_prefixes']} received, "
+        f"{old['active_prefixes']} -> {new['active_prefixes']} active"
+    )
@@ -0,0 +1,190 @@
+import json
+import os
+import sqlite3
+import time
+from collections import Counter
+
+# Rows buffered before each write transaction
+BATCH_SIZE = 5000
+
+PEER_COLUMNS = (
+    "peer_address", "local_address", "peer_as", "local_as", "peer_state",
+    "peer_type", "peer_group", "description", "flap_count",
+    "received_prefixes", "active_prefixes",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bgp_peers (
+    run_id INTEGER NOT NULL,
+    device TEXT NOT NULL,
+    peer_address TEXT,
+    local_address TEXT,
+    peer_as INTEGER,
+    local_as INTEGER,
+    peer_state TEXT,
+    peer_type TEXT,
+    peer_group TEXT,
+    description TEXT,
+    flap_count INTEGER,
+    received_prefixes INTEGER,
+    active_prefixes INTEGER,
+    collected_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_bgp_peers_device ON bgp_peers (device);
+CREATE INDEX IF NOT EXISTS idx_bgp_peers_peer_address ON bgp_peers (peer_address);
+CREATE INDEX IF NOT EXISTS idx_bgp_peers_peer_as ON bgp_peers (peer_as);
+CREATE INDEX IF NOT EXISTS idx_bgp_peers_peer_state ON bgp_peers (peer_state);
+CREATE INDEX IF NOT EXISTS idx_bgp_peers_run_id ON bgp_peers (run_id);
+"""
+
+
+class SqliteSink:
+    """
+    Store peers in an SQLite database, replacing each device's previous rows.
+
+    Rows are written in batches of batch_size per transaction. summary()
+    counts only the peers written during this run.
+    """
+
+    def __init__(self, path, batch_size=BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.run_id = time.time_ns()
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._rows = []
+        self._replaced = set()
+
+    def write(self, host, peers):
+        """
+        Queue a device's peers, flushing whenever a batch fills up.
+        """
+        now = time.time()
+        if host in self._replaced:
+            # Written twice before a flush: only the newer peers count
+            self._rows = [row for row in self._rows if row[1] != host]
+        else:
+            self._replaced.add(host)
+        for peer in peers:
+            self._rows.append((self.run_id, host, *(peer.get(c) for c in PEER_COLUMNS), now))
+            if len(self._rows) >= self.batch_size:
+                self.flush()
+
+    def update(self, host, peers):
+        """
+        Replace only the given peers of a device, matched by peer address.
+        Pending batches are flushed first and the update is written at once.
+        """
+        self.flush()
+        now = time.time()
+        placeholders = ", ".join("?" * (len(PEER_COLUMNS) + 3))
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM bgp_peers WHERE device = ? AND peer_address = ?",
+                [(host, peer.get("peer_address")) for peer in peers],
+            )
+            self.conn.executemany(
+                f"INSERT INTO bgp_peers (run_id, device, {', '.join(PEER_COLUMNS)}, collected_at) "
+                f"VALUES ({placeholders})",
+                [(self.run_id, host, *(peer.get(c) for c in PEER_COLUMNS), now) for peer in peers],
+            )
+
+    def flush(self):
+        if not self._rows and not self._replaced:
+            return
+        placeholders = ", ".join("?" * (len(PEER_COLUMNS) + 3))
+        with self.conn:
+            # A device's first flush of a write drops all its older rows
+            self.conn.executemany(
+                "DELETE FROM bgp_peers WHERE device = ?", [(host,) for host in self._replaced]
+            )
+            self.conn.executemany(
+                f"INSERT INTO bgp_peers (run_id, device, {', '.join(PEER_COLUMNS)}, collected_at) "
+                f"VALUES ({placeholders})",
+                self._rows,
+            )
+        self._rows = []
+        self._replaced = set()
+
+    def summary(self):
+        """
+        Return peer, device and per-state counts for this run.
+        """
+        self.flush()
+        run = (self.run_id,)
+        total, devices = self.conn.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT device) FROM bgp_peers WHERE run_id = ?", run
+        ).fetchone()
+        states = self.conn.execute(
+            "SELECT peer_state, COUNT(*) FROM bgp_peers WHERE run_id = ? GROUP BY peer_state", run
+        ).fetchall()
+        return {"peers": total, "devices": devices, "states": dict(states)}
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+class JsonlSink:
+    """
+    Write peers as JSON lines, one object per peer with its device.
+    """
+
+    def __init__(self, path, batch_size=BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.file = open(path, "w")
+        self._lines = []
+        self._devices = set()
+        self._states = Counter()
+
+    def write(self, host, peers):
+        self._devices.add(host)
+        for peer in peers:
+            self._lines.append(json.dumps({"device": host, **peer}))
+            self._states[peer.get("peer_state")] += 1
+            if len(self._lines) >= self.batch_size:
+                self.flush()
+
+    def update(self, host, peers):
+        """
+        JSON lines are a log: updated peers are appended like any others.
+        """
+        self.write(host, peers)
+
+    def flush(self):
+        if self._lines:
+            self.file.write("\n".join(self._lines) + "\n")
+            self._lines = []
+        self.file.flush()
+
+    def summary(self):
+        return {
+            "peers": sum(self._states.values()),
+            "devices": len(self._devices),
+            "states": dict(self._states),
+        }
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+# Result sinks by output file extension
+SINKS = {
+    ".db": SqliteSink,
+    ".sqlite": SqliteSink,
+    ".jsonl": JsonlSink,
+}
+
+
+def open_sink(path, batch_size=BATCH_SIZE):
+    """
+    Open the result sink matching the output file's extension.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in SINKS:
+        raise ValueError(f"Unsupported output format '{extension}' (use one of: {', '.join(SINKS)})")
+    return SINKS[extension](path, batch_size=batch_size)
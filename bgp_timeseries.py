@@ -0,0 +1,381 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import time
+
+from bgp_snapshot import peer_key
+
+try:
+    import numpy as np
+except ImportError:  # vectorized analysis is optional
+    np = None
+
+# History defaults
+MAX_PEERS = 65536
+SAMPLES = 96
+FLAP_WINDOW = 3600
+MIN_FLAPS = 3
+
+# File header: magic, peer slots, samples per slot
+MAGIC = b"BGPTS\x00\x00\x01"
+HEADER = struct.Struct("<8sII")
+HEADER_SIZE = 64
+
+# Peer states stored as one byte each; 0 is anything else
+STATES = ("", "Idle", "Connect", "Active", "OpenSent", "OpenConfirm", "Established")
+STATE_CODES = {name: code for code, name in enumerate(STATES)}
+
+# Per-sample columns and their array typecodes; each peer slot holds a row of samples
+COLUMNS = (("time", "I"), ("flaps", "I"), ("received", "I"), ("active", "I"), ("state", "B"))
+ITEM_SIZES = {"I": 4, "B": 1}
+
+
+def open_private(path, flags, mode):
+    """
+    Open path for writing, creating it readable only by its owner.
+    """
+    return os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | flags, 0o600), mode)
+
+
+class PeerHistory:
+    """
+    Recent samples of every peer's counters in fixed-size ring buffers,
+    kept in a memory-mapped file.
+
+    Each peer owns a slot of samples entries per column (time, flap count,
+    received and active prefixes, state), overwritten oldest first, so the
+    file and the memory it maps never grow. Once all max_peers slots are
+    taken, the peer updated longest ago gives up its slot. Writes land in
+    the shared mapping and reach the file even if the process dies; an
+    existing file keeps the dimensions it was created with.
+
+    Slot owners are appended to {path}.keys as [slot, device, peer key],
+    the key qualified by routing instance as in bgp_snapshot.peer_key().
+    """
+
+    def __init__(self, path, max_peers=MAX_PEERS, samples=SAMPLES):
+        self.path = path
+        if os.path.exists(path) and os.path.getsize(path) >= HEADER_SIZE:
+            with open(path, "rb") as f:
+                magic, max_peers, samples = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a peer history file")
+        else:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "r+b") as f:
+                f.write(HEADER.pack(MAGIC, max_peers, samples))
+        self.max_peers = max_peers
+        self.samples = samples
+
+        size = HEADER_SIZE + 8 * max_peers + sum(ITEM_SIZES[code] for _, code in COLUMNS) * max_peers * samples
+        self._file = open(path, "r+b")
+        if os.path.getsize(path) < size:
+            self._file.truncate(size)
+        self._mmap = mmap.mmap(self._file.fileno(), size)
+
+        offset = HEADER_SIZE
+        self.head = self._view(offset, "I", max_peers)
+        self.count = self._view(offset + 4 * max_peers, "I", max_peers)
+        offset += 8 * max_peers
+        self.columns = {}
+        for name, code in COLUMNS:
+            self.columns[name] = self._view(offset, code, max_peers * samples)
+            offset += ITEM_SIZES[code] * max_peers * samples
+
+        self.slots = {}
+        self.slot_keys = []
+        self._load_keys()
+
+    def _view(self, offset, code, length):
+        if np is not None:
+            return np.frombuffer(self._mmap, dtype=np.dtype(code), count=length, offset=offset)
+        return memoryview(self._mmap)[offset:offset + ITEM_SIZES[code] * length].cast(code)
+
+    def _load_keys(self):
+        keys_path = f"{self.path}.keys"
+        lines = 0
+        if os.path.exists(keys_path):
+            owners = {}
+            with open(keys_path) as f:
+                for line in f:
+                    if line.strip():
+                        slot, device, key = json.loads(line)
+                        owners[slot] = (device, key)
+                        lines += 1
+            self.slot_keys = [owners.get(slot) for slot in range(max(owners, default=-1) + 1)]
+            self.slots = {owner: slot for slot, owner in enumerate(self.slot_keys) if owner}
+
+        # Rewrite the log once evictions have left it mostly superseded
+        if lines > 2 * len(self.slots) + 1000:
+            tmp_path = f"{keys_path}.tmp"
+            with open_private(tmp_path, os.O_TRUNC, "w") as f:
+                for slot, owner in enumerate(self.slot_keys):
+                    if owner:
+                        f.write(json.dumps([slot, *owner]) + "\n")
+            os.replace(tmp_path, keys_path)
+        self._keys_file = open_private(keys_path, os.O_APPEND, "a")
+
+    def last_update(self, slot):
+        if not self.count[slot]:
+            return 0
+        return self.columns["time"][slot * self.samples + (int(self.head[slot]) - 1) % self.samples]
+
+    def _eviction_order(self):
+        """
+        Return every slot, most recently updated first.
+        """
+        if np is None:
+            return sorted(range(self.max_peers), key=self.last_update, reverse=True)
+        last = self.columns["time"].reshape(self.max_peers, self.samples)[
+            np.arange(self.max_peers), (self.head.astype(np.int64) - 1) % self.samples
+        ]
+        last = np.where(self.count > 0, last, 0).astype(np.int64)
+        return np.argsort(-last, kind="stable").tolist()
+
+    def _assign(self, owner, evictable, taken):
+        """
+        Give owner a free slot, or evict the least recently updated slot
+        not in taken. Returns None if every slot is taken.
+        """
+        if len(self.slot_keys) < self.max_peers:
+            slot = len(self.slot_keys)
+            self.slot_keys.append(owner)
+        else:
+            if evictable is None:
+                return None
+            while evictable and evictable[-1] in taken:
+                evictable.pop()
+            if not evictable:
+                return None
+            slot = evictable.pop()
+            del self.slots[self.slot_keys[slot]]
+            self.slot_keys[slot] = owner
+        # Whatever the slot held before belongs to someone else
+        self.head[slot] = self.count[slot] = 0
+        self.slots[owner] = slot
+        self._keys_file.write(json.dumps([slot, *owner]) + "\n")
+        return slot
+
+    def record(self, device, peers, when=None):
+        """
+        Append a sample for each of device's peers.
+
+        Slots used in this call are never evicted by it, so peers beyond
+        max_peers in one call go unrecorded, as does any peer repeating
+        an earlier one's key.
+        """
+        when = int(when or time.time())
+        peers = list(peers)
+        owners = [(device, peer_key(peer)) for peer in peers]
+        taken = {self.slots[owner] for owner in owners if owner in self.slots}
+        # Slots ordered most recently updated first, computed on the first eviction
+        evictable = None
+        assigned = False
+        slots, values = [], []
+        used = set()
+        for peer, owner in zip(peers, owners):
+            if owner in used:
+                continue
+            used.add(owner)
+            slot = self.slots.get(owner)
+            if slot is None:
+                if evictable is None and len(self.slot_keys) >= self.max_peers:
+                    evictable = self._eviction_order()
+                slot = self._assign(owner, evictable, taken)
+                if slot is None:
+                    continue
+                taken.add(slot)
+                assigned = True
+            slots.append(slot)
+            values.append((
+                peer.get("flap_count") or 0, peer.get("received_prefixes") or 0,
+                peer.get("active_prefixes") or 0, STATE_CODES.get(peer.get("peer_state"), 0),
+            ))
+        if assigned:
+            # Slot owners must survive a crash as surely as the samples do
+            self._keys_file.flush()
+        if not slots:
+            return
+
+        samples, columns = self.samples, self.columns
+        if np is not None:
+            slots = np.array(slots, dtype=np.int64)
+            positions = self.head[slots].astype(np.int64)
+            index = slots * samples + positions
+            columns["time"][index] = when
+            for name, column in zip(("flaps", "received", "active", "state"), zip(*values)):
+                columns[name][index] = column
+            self.head[slots] = (positions + 1) % samples
+            self.count[slots] = np.minimum(self.count[slots] + 1, samples)
+            return
+
+        times, flaps = columns["time"], columns["flaps"]
+        received, active, state = columns["received"], columns["active"], columns["state"]
+        for slot, (flap_count, received_prefixes, active_prefixes, state_code) in zip(slots, values):
+            position = self.head[slot]
+            index = slot * samples + position
+            times[index] = when
+            flaps[index] = flap_count
+            received[index] = received_prefixes
+            active[index] = active_prefixes
+            state[index] = state_code
+            self.head[slot] = (position + 1) % samples
+            self.count[slot] = min(self.count[slot] + 1, samples)
+
+    def window(self, seconds, now=None):
+        """
+        Return per-slot statistics over the last seconds, as a dict of
+        equal-length columns indexed by slot:
+
+        samples          samples inside the window
+        flaps            increase of the device's flap counter
+        state_changes    consecutive samples whose state differs
+        received_delta   newest minus oldest received prefix count
+        received_churn   total absolute change of the received count
+        received_rate    received_delta per second
+        """
+        cutoff = (now or time.time()) - seconds
+        if np is None:
+            return self._window_python(cutoff)
+
+        used = len(self.slot_keys)
+        depth = self.samples
+        # Reorder each ring oldest first and mask slots not yet written or outside the window
+        order = (self.head[:used, None].astype(np.int64) + np.arange(depth)) % depth
+
+        def chronological(name):
+            return np.take_along_axis(self.columns[name].reshape(self.max_peers, depth)[:used], order, axis=1)
+
+        times = chronological("time")
+        valid = (np.arange(depth) >= depth - self.count[:used, None].astype(np.int64)) & (times >= cutoff)
+        pairs = valid[:, 1:] & valid[:, :-1]
+        samples = valid.sum(axis=1)
+
+        def steps(name):
+            return np.diff(chronological(name).astype(np.int64), axis=1) * pairs
+
+        flap_steps = steps("flaps")
+        received_steps = steps("received")
+        state_changes = (steps("state") != 0).sum(axis=1)
+        received_delta = received_steps.sum(axis=1)
+
+        # Span between the oldest and newest sample in the window
+        first = np.where(valid, times, np.iinfo(np.uint32).max).min(axis=1).astype(np.int64)
+        last = np.where(valid, times, 0).max(axis=1).astype(np.int64)
+        elapsed = np.where(samples > 1, last - first, 0)
+        return {
+            "samples": samples,
+            # A cleared counter steps down; only increases count as flaps
+            "flaps": np.clip(flap_steps, 0, None).sum(axis=1),
+            "state_changes": state_changes,
+            "received_delta": received_delta,
+            "received_churn": np.abs(received_steps).sum(axis=1),
+            "received_rate": np.divide(received_delta, elapsed, out=np.zeros(used), where=elapsed > 0),
+        }
+
+    def _window_python(self, cutoff):
+        stats = {name: [] for name in ("samples", "flaps", "state_changes", "received_delta",
+                                       "received_churn", "received_rate")}
+        columns = self.columns
+        for slot in range(len(self.slot_keys)):
+            base, head, count = slot * self.samples, self.head[slot], self.count[slot]
+            rows = []
+            for offset in range(self.samples - count, self.samples):
+                index = base + (head + offset) % self.samples
+                if columns["time"][index] >= cutoff:
+                    rows.append((columns["time"][index], columns["flaps"][index],
+                                 columns["received"][index], columns["state"][index]))
+            pairs = list(zip(rows, rows[1:]))
+            delta = sum(b[2] - a[2] for a, b in pairs)
+            elapsed = rows[-1][0] - rows[0][0] if len(rows) > 1 else 0
+            stats["samples"].append(len(rows))
+            stats["flaps"].append(sum(max(b[1] - a[1], 0) for a, b in pairs))
+            stats["state_changes"].append(sum(a[3] != b[3] for a, b in pairs))
+            stats["received_delta"].append(delta)
+            stats["received_churn"].append(sum(abs(b[2] - a[2]) for a, b in pairs))
+            stats["received_rate"].append(delta / elapsed if elapsed else 0.0)
+        return stats
+
+    def flapping(self, seconds=FLAP_WINDOW, min_flaps=MIN_FLAPS, now=None):
+        """
+        Return peers that flapped or changed state at least min_flaps times
+        in the last seconds, as dicts, worst first.
+        """
+        stats = self.window(seconds, now)
+        flaps, changes = stats["flaps"], stats["state_changes"]
+        if np is not None:
+            slots = np.nonzero(np.maximum(flaps, changes) >= min_flaps)[0].tolist()
+        else:
+            slots = [slot for slot, counts in enumerate(zip(flaps, changes)) if max(counts) >= min_flaps]
+        found = [
+            {"device": self.slot_keys[slot][0], "peer": self.slot_keys[slot][1],
+             "flaps": int(flaps[slot]), "state_changes": int(changes[slot])}
+            for slot in slots if self.slot_keys[slot]
+        ]
+        return sorted(found, key=lambda peer: -max(peer["flaps"], peer["state_changes"]))
+
+    def churn(self, seconds=FLAP_WINDOW, top=10, now=None):
+        """
+        Return the top peers by received prefix churn in the last seconds.
+        """
+        stats = self.window(seconds, now)
+        churn = stats["received_churn"]
+        if np is not None:
+            slots = np.argsort(-np.asarray(churn), kind="stable")[:top].tolist()
+        else:
+            slots = sorted(range(len(churn)), key=lambda slot: -churn[slot])[:top]
+        return [
+            {"device": self.slot_keys[slot][0], "peer": self.slot_keys[slot][1], "churn": int(churn[slot]),
+             "delta": int(stats["received_delta"][slot]), "rate": float(stats["received_rate"][slot])}
+            for slot in slots if churn[slot] > 0 and self.slot_keys[slot]
+        ]
+
+    def flush(self):
+        self._mmap.flush()
+        self._keys_file.flush()
+
+    def close(self):
+        self.flush()
+        self._keys_file.close()
+        # Views must be released before the mapping can close
+        if np is None:
+            for view in (self.head, self.count, *self.columns.values()):
+                view.release()
+        self.head = self.count = self.columns = None
+        self._mmap.close()
+        self._file.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report flapping peers and prefix churn from the peer history.")
+    parser.add_argument("--history", default="bgp_history.ts",
+                        help="History file written with --history by the collectors (default: bgp_history.ts)")
+    parser.add_argument("--window", type=float, default=FLAP_WINDOW,
+                        help=f"Seconds of history to look at (default: {FLAP_WINDOW})")
+    parser.add_argument("--min-flaps", type=int, default=MIN_FLAPS,
+                        help=f"Flaps or state changes in the window that count as flapping (default: {MIN_FLAPS})")
+    parser.add_argument("--top", type=int, default=10, help="Peers listed by prefix churn (default: 10)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.history):
+        parser.error(f"No history file at {args.history}")
+    history = PeerHistory(args.history)
+    try:
+        start = time.perf_counter()
+        flapping = history.flapping(args.window, args.min_flaps)
+        churn = history.churn(args.window, args.top)
+        elapsed = time.perf_counter() - start
+    finally:
+        history.close()
+
+    print(f"{len(history.slots)} peers tracked, {history.samples} samples each; analysed in {elapsed * 1000:.1f}ms")
+    print(f"\nFlapping ({len(flapping)}):")
+    for peer in flapping:
+        print(f"  {peer['device']:<20} {peer['peer']:<40} {peer['flaps']} flaps, "
+              f"{peer['state_changes']} state changes")
+    print("\nTop prefix churn:")
+    for peer in churn:
+        print(f"  {peer['device']:<20} {peer['peer']:<40} churn {peer['churn']}, "
+              f"net {peer['delta']:+d} ({peer['rate'] * 60:+.1f}/min)")
@@ -1,4 +1,21 @@
-from junos_lib import JunosDevice, JunosInventoryManager
+import argparse
+import json
+import os
+import time
+
+from bgp_snapshot import SnapshotStore, format_change
+from bgp_store import open_sink
+from bgp_timeseries import PeerHistory
+from junos_bgp import fetch_bgp_peers, fetch_bundle, parse_fields, parse_peers, start_parser_pool
+from junos_cache import CACHE_TTL, CachingPool, RpcCache
+from junos_fleet import (
+    CONNECT_TIMEOUT, MAX_WORKERS, PROBE_TIMEOUT, RPC_TIMEOUT, CircuitBreaker, add_governor_args,
+    governor_from_args, iter_fleet, probe_reachable
+)
+from junos_inventory import load_inventory
+from junos_metrics import PhaseMetrics, timed
+from junos_sessions import UNREACHABLE_ERRORS
+from session_broker import DEFAULT_SOCKET, connect_pool
 
 def select_option(prompt, options):
     """
@@ -16,27 +33,86 @@ def select_option(prompt, options):
         print("Invalid choice. Please try again.")
         return select_option(prompt, options)
 
+
+# Command Line Options
+parser = argparse.ArgumentParser(description="Retrieve BGP peers from Junos devices.")
+parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                    help=f"Devices processed in parallel (default: {MAX_WORKERS})")
+add_governor_args(parser)
+parser.add_argument("--connect-timeout", type=float, default=CONNECT_TIMEOUT,
+                    help=f"Seconds allowed for each device to connect (default: {CONNECT_TIMEOUT})")
+parser.add_argument("--rpc-timeout", type=float, default=RPC_TIMEOUT,
+                    help=f"Seconds allowed for each BGP RPC (default: {RPC_TIMEOUT})")
+parser.add_argument("--fields",
+                    help="Comma-separated peer fields to collect (default: all). If every field is one of "
+                         "peer_address, peer_state, peer_as, flap_count, received_prefixes and active_prefixes, "
+                         "the much smaller BGP summary RPC is used")
+parser.add_argument("--output", default="bgp_peers.db",
+                    help="Result file; .db/.sqlite for SQLite or .jsonl for JSON lines (default: bgp_peers.db)")
+parser.add_argument("--history",
+                    help="Also append every peer's counters to this ring-buffer history file "
+                         "(read it with bgp_timeseries.py)")
+parser.add_argument("--diff", action="store_true",
+                    help="Report only sessions added, removed or changed since the last --diff run")
+parser.add_argument("--snapshots", default="bgp_snapshots.db",
+                    help="Snapshot database used by --diff (default: bgp_snapshots.db)")
+parser.add_argument("--changes-file", default="bgp_changes.jsonl",
+                    help="JSON lines file --diff appends changes to (default: bgp_changes.jsonl)")
+parser.add_argument("--parse-processes", type=int, default=0,
+                    help="Parse replies in this many worker processes (default: 0, parse in threads)")
+parser.add_argument("--bundle-dir",
+                    help="Also pipeline BGP summary, route summary and interface RPCs on the same session "
+                         "and save their raw replies under this directory")
+parser.add_argument("--cache-ttl", type=float, default=CACHE_TTL,
+                    help=f"Reuse replies fetched within this many seconds (default: {CACHE_TTL})")
+parser.add_argument("--cache-file", default=".rpc_cache.db",
+                    help="Where cached replies are kept between runs (default: .rpc_cache.db)")
+parser.add_argument("--no-cache", action="store_true",
+                    help="Always query the devices, ignoring and not updating the reply cache")
+parser.add_argument("--broker", default=DEFAULT_SOCKET,
+                    help=f"Session broker socket to use when one is running (default: {DEFAULT_SOCKET})")
+parser.add_argument("--no-broker", action="store_true",
+                    help="Always open private NETCONF sessions, even if a broker is running")
+parser.add_argument("--metrics-prom",
+                    help="Write per-phase timing histograms to this Prometheus text file")
+parser.add_argument("--metrics-json",
+                    help="Write per-phase and per-device timings to this JSON file")
+parser.add_argument("--probe-timeout", type=float, default=PROBE_TIMEOUT,
+                    help=f"Seconds to wait for the NETCONF port in the reachability probe (default: {PROBE_TIMEOUT})")
+parser.add_argument("--no-probe", action="store_true",
+                    help="Skip the reachability probe before connecting")
+parser.add_argument("--breaker-file", default=".circuit_breaker.json",
+                    help="Where recently failed devices are remembered (default: .circuit_breaker.json)")
+parser.add_argument("--ignore-breaker", action="store_true",
+                    help="Try devices even if they failed recently")
+parser.add_argument("--tag", action="append", default=[],
+                    help="Only include devices carrying this inventory tag (repeatable)")
+args = parser.parse_args()
+try:
+    fields = parse_fields(args.fields)
+except ValueError as e:
+    parser.error(str(e))
+
 # Load Inventory
-inventory_manager = JunosInventoryManager('device_inventory.yml')
-inventory = inventory_manager.load_inventory()
+inventory = load_inventory('device_inventory.yml')
 
 # Interactive Site Selection
 if inventory:
-    sites = list(inventory.keys())
+    sites = inventory.sites()
     selected_site = select_option("Select a site:", sites)
     if not selected_site:
         print("No site selected. Exiting.")
         exit()
 
     # Interactive Category Selection
-    categories = list(inventory[selected_site].keys())
+    categories = inventory.categories(selected_site)
     selected_category = select_option("Select a category:", categories)
     if not selected_category:
         print("No category selected. Exiting.")
         exit()
 
     # Interactive Host Selection
-    devices = inventory[selected_site][selected_category]
+    devices = inventory.select(site=selected_site, category=selected_category, tags=args.tag)
     device_hosts = [device["host"] for device in devices]
     device_hosts.append("All Hosts")  # Add an option for all hosts
     selected_host = select_option("Select a host (or 'All Hosts'):", device_hosts)
@@ -48,48 +124,109 @@ if inventory:
     if selected_host == "All Hosts":
         target_devices = devices
     else:
-        target_devices = [device for device in devices if device["host"] == selected_host]
-
-    # Initialize output file
-    output_file = "bgp_peers.txt"
-    with open(output_file, "w") as f:
-        f.write("")  # Clear the file before appending new data
-
-    # Process target devices
-    for device in target_devices:
-        try:
-            # Create an instance of the JunosDevice class
-            junos_device = JunosDevice(
-                host=device["host"],
-                user=device["user"],
-                password=device["password"],
-                port=device.get("port", 830)
-            )
-            junos_device.connect()
+        target_devices = inventory.select(site=selected_site, category=selected_category,
+                                          hosts=[selected_host], tags=args.tag)
 
-            print("=" * 60)
-            print(f"Processing Device: {junos_device.host}")
-            print("=" * 60)
+    # Skip devices that failed recently, then probe the rest before handshaking
+    breaker = CircuitBreaker(args.breaker_file)
+    if not args.ignore_breaker:
+        for device in target_devices:
+            if not breaker.allow(device["host"]):
+                print(f"Skipping device {device['host']}: failed recently, "
+                      f"retrying in {breaker.retry_in(device['host']):.0f}s")
+        target_devices = [device for device in target_devices if breaker.allow(device["host"])]
+
+    if not args.no_probe and target_devices:
+        reachable = probe_reachable(target_devices, args.probe_timeout)
+        for device in target_devices:
+            if device["host"] not in reachable:
+                print(f"Error processing device {device['host']}: NETCONF port unreachable")
+                breaker.record_failure(device["host"])
+        target_devices = [device for device in target_devices if device["host"] in reachable]
+
+    # Initialize output store
+    output_file = args.output
+    sink = open_sink(output_file)
+    parser_pool = start_parser_pool(args.parse_processes) if args.parse_processes else None
+    metrics = PhaseMetrics() if args.metrics_prom or args.metrics_json else None
+    pool = connect_pool(args.broker, not args.no_broker, connect_timeout=args.connect_timeout,
+                        rpc_timeout=args.rpc_timeout, metrics=metrics)
+    if not args.no_cache:
+        pool = CachingPool(pool, RpcCache(args.cache_file, args.cache_ttl))
+    governor = governor_from_args(args)
+    snapshots = SnapshotStore(args.snapshots) if args.diff else None
+    history = PeerHistory(args.history) if args.history else None
+    changes_file = open(args.changes_file, "a") if args.diff else None
+    total_changes = 0
 
-            # Retrieve and write BGP peers to the output file
-            result = junos_device.get_bgp_peers(output_file=output_file)
-            print(result)
+    # Process target devices in parallel, storing results in inventory order
+    def process_device(device):
+        if not args.bundle_dir:
+            return list(fetch_bgp_peers(pool, device, parser_pool, fields))
 
-            # Close connection
-            junos_device.close()
+        replies = fetch_bundle(pool, device)
+        device_dir = os.path.join(args.bundle_dir, device["host"])
+        os.makedirs(device_dir, exist_ok=True)
+        for name, reply in replies.items():
+            if name != "bgp_neighbors":
+                with open(os.path.join(device_dir, f"{name}.xml"), "w") as f:
+                    f.write(reply)
+        return list(parse_peers(replies["bgp_neighbors"], device, parser_pool, metrics, fields))
 
-        except Exception as e:
-            print(f"Error processing device {device['host']}: {e}")
+    try:
+        for device, peers, error in iter_fleet(target_devices, process_device, max_workers=args.workers,
+                                                 governor=governor):
+            if error:
+                print(f"Error processing device {device['host']}: {error}")
+                # A device that answered, even with an error, is not cut off
+                if isinstance(error, UNREACHABLE_ERRORS):
+                    breaker.record_failure(device["host"])
+                continue
+
+            breaker.record_success(device["host"])
+            with timed(metrics, device["host"], "write", device.get("site")):
+                sink.write(device["host"], peers)
+                if history:
+                    history.record(device["host"], peers)
+
+            # In diff mode only report what changed since the last snapshot
+            if snapshots:
+                changes = snapshots.diff(device["host"], peers)
+                total_changes += len(changes)
+                now = time.time()
+                for change in changes:
+                    print(format_change(device["host"], change))
+                    changes_file.write(json.dumps({"time": now, "device": device["host"], **change}) + "\n")
+                continue
+
+            print("=" * 60)
+            print(f"Processing Device: {device['host']}")
+            print("=" * 60)
+            print(f"{len(peers)} BGP peers retrieved")
+
+        summary = sink.summary()
+    finally:
+        breaker.save()
+        pool.close_all()
+        sink.close()
+        if parser_pool:
+            parser_pool.shutdown()
+        if metrics:
+            metrics.write(args.metrics_prom, args.metrics_json)
+        if snapshots:
+            snapshots.close()
+            changes_file.close()
+        if history:
+            history.close()
 else:
     print("No inventory found. Please check your device_inventory.yml file.")
     exit()
 
 # Display summary
 print("\n=== Summary ===")
-try:
-    with open(output_file, "r") as f:
-        peers = f.readlines()
-        print(f"Total BGP Peers retrieved: {len(peers)}")
-        print(f"Peers saved to: {output_file}")
-except FileNotFoundError:
-    print("Output file not found.")
\ No newline at end of file
+print(f"Total BGP Peers retrieved: {summary['peers']} from {summary['devices']} device(s)")
+for state, count in sorted(summary["states"].items(), key=lambda item: -item[1]):
+    print(f"  {state}: {count}")
+print(f"Peers saved to: {output_file}")
+if args.diff:
+    print(f"Changes since last snapshot: {total_changes} (logged to {args.changes_file})")
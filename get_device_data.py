@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+
+from junos_bgp import start_parser_pool
+from junos_cache import CACHE_TTL, CachingPool, RpcCache
+from junos_collectors import COLLECTORS, run_collectors
+from junos_fleet import CONNECT_TIMEOUT, MAX_WORKERS, RPC_TIMEOUT, add_governor_args, governor_from_args, iter_fleet
+from junos_inventory import load_inventory
+from junos_metrics import PhaseMetrics, timed
+from session_broker import DEFAULT_SOCKET, connect_pool
+
+
+def collect_fleet(devices, names, args):
+    """
+    Run the named collectors on every device and write one JSON lines file
+    per collector under args.output_dir.
+    """
+    os.makedirs(args.output_dir, exist_ok=True)
+    files = {name: open(os.path.join(args.output_dir, f"{name}.jsonl"), "w") for name in names}
+    counts = dict.fromkeys(names, 0)
+    parser_pool = start_parser_pool(args.parse_processes) if args.parse_processes else None
+    metrics = PhaseMetrics() if args.metrics_prom or args.metrics_json else None
+    pool = connect_pool(args.broker, not args.no_broker, connect_timeout=args.connect_timeout,
+                        rpc_timeout=args.rpc_timeout, metrics=metrics)
+    if not args.no_cache:
+        pool = CachingPool(pool, RpcCache(args.cache_file, args.cache_ttl))
+    governor = governor_from_args(args)
+
+    def process_device(device):
+        return run_collectors(pool, device, names, parser_pool)
+
+    try:
+        for device, outcome, error in iter_fleet(devices, process_device, max_workers=args.workers,
+                                                 governor=governor):
+            host = device["host"]
+            if error:
+                print(f"Error processing device {host}: {error}")
+                continue
+
+            results, errors = outcome
+            for name, error in errors.items():
+                print(f"Error collecting {name} from {host}: {error}")
+            with timed(metrics, host, "write", device.get("site")):
+                for name, records in results.items():
+                    files[name].writelines(json.dumps({"device": host, **record}) + "\n" for record in records)
+                    counts[name] += len(records)
+            print(f"{host}: " + ", ".join(f"{len(records)} {name}" for name, records in results.items()))
+    finally:
+        pool.close_all()
+        for f in files.values():
+            f.close()
+        if parser_pool:
+            parser_pool.shutdown()
+        if metrics:
+            metrics.write(args.metrics_prom, args.metrics_json)
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collect several kinds of data from Junos devices in one session.")
+    parser.add_argument("--inventory", default="device_inventory.yml",
+                        help="Device inventory file (default: device_inventory.yml)")
+    parser.add_argument("--site", help="Only collect from devices at this site")
+    parser.add_argument("--category", help="Only collect from devices in this category")
+    parser.add_argument("--host", action="append", help="Only collect from this device (repeatable)")
+    parser.add_argument("--tag", action="append", default=[],
+                        help="Only collect from devices carrying this inventory tag (repeatable)")
+    parser.add_argument("--collect", default="bgp",
+                        help=f"Comma-separated collectors to run: {', '.join(COLLECTORS)} (default: bgp)")
+    parser.add_argument("--output-dir", default="device_data",
+                        help="Directory for one <collector>.jsonl file per collector (default: device_data)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                        help=f"Devices processed in parallel (default: {MAX_WORKERS})")
+    add_governor_args(parser)
+    parser.add_argument("--connect-timeout", type=float, default=CONNECT_TIMEOUT,
+                        help=f"Seconds allowed for each device to connect (default: {CONNECT_TIMEOUT})")
+    parser.add_argument("--rpc-timeout", type=float, default=RPC_TIMEOUT,
+                        help=f"Seconds allowed for each device's RPC bundle (default: {RPC_TIMEOUT})")
+    parser.add_argument("--parse-processes", type=int, default=0,
+                        help="Parse BGP replies in this many worker processes (default: 0, parse in threads)")
+    parser.add_argument("--cache-ttl", type=float, default=CACHE_TTL,
+                        help=f"Reuse replies fetched within this many seconds (default: {CACHE_TTL})")
+    parser.add_argument("--cache-file", default=".rpc_cache.db",
+                        help="Where cached replies are kept between runs (default: .rpc_cache.db)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always query the devices, ignoring and not updating the reply cache")
+    parser.add_argument("--broker", default=DEFAULT_SOCKET,
+                        help=f"Session broker socket to use when one is running (default: {DEFAULT_SOCKET})")
+    parser.add_argument("--no-broker", action="store_true",
+                        help="Always open private NETCONF sessions, even if a broker is running")
+    parser.add_argument("--metrics-prom",
+                        help="Write per-phase timing histograms to this Prometheus text file")
+    parser.add_argument("--metrics-json",
+                        help="Write per-phase and per-device timings to this JSON file")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.collect.split(",") if name.strip()]
+    unknown = [name for name in names if name not in COLLECTORS]
+    if unknown:
+        parser.error(f"Unknown collector(s): {', '.join(unknown)} (choose from: {', '.join(COLLECTORS)})")
+
+    inventory = load_inventory(args.inventory)
+    devices = inventory.select(site=args.site, category=args.category, hosts=args.host, tags=args.tag)
+    if not devices:
+        print("No matching devices found. Please check your inventory and filters.")
+        exit()
+
+    counts = collect_fleet(devices, names, args)
+
+    print("\n=== Summary ===")
+    for name, count in counts.items():
+        print(f"  {name}: {count} record(s) -> {os.path.join(args.output_dir, name + '.jsonl')}")
@@ -0,0 +1,471 @@
+import multiprocessing
+import socket
+import sys
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from xml.parsers import expat
+
+from junos_metrics import timed
+from junos_sessions import RpcReplyError
+
+BGP_NEIGHBOR_RPC = "<get-bgp-neighbor-information/>"
+BGP_SUMMARY_RPC = "<get-bgp-summary-information/>"
+BGP_PEER_RPC = "<get-bgp-neighbor-information><neighbor-address>{address}</neighbor-address></get-bgp-neighbor-information>"
+
+# RPCs commonly wanted alongside the BGP neighbor table, by name
+STANDARD_BUNDLE = {
+    "bgp_neighbors": BGP_NEIGHBOR_RPC,
+    "bgp_summary": BGP_SUMMARY_RPC,
+    "route_summary": "<get-route-summary-information/>",
+    "interfaces": "<get-interface-information><terse/></get-interface-information>",
+}
+
+# Bytes handed to the XML parser at a time
+CHUNK_SIZE = 64 * 1024
+
+# Integer fields copied straight from a <bgp-peer>
+INT_FIELDS = ("peer-as", "local-as", "flap-count")
+
+# Fields a BgpPeer exposes through its dict-style interface
+PEER_FIELDS = (
+    "peer_address", "local_address", "peer_state", "peer_type", "peer_group",
+    "description", "received_prefixes", "active_prefixes", "peer_as", "local_as",
+    "flap_count", "routing_instance",
+)
+
+# <bgp-peer> child element each field is read from
+FIELD_ELEMENTS = {
+    "peer_address": "peer-address",
+    "local_address": "local-address",
+    "peer_state": "peer-state",
+    "peer_type": "peer-type",
+    "peer_group": "peer-group",
+    "description": "description",
+    "received_prefixes": "bgp-rib",
+    "active_prefixes": "bgp-rib",
+    "peer_as": "peer-as",
+    "local_as": "local-as",
+    "flap_count": "flap-count",
+    "routing_instance": "peer-cfg-rti",
+}
+
+# Fields the much smaller get-bgp-summary-information reply also carries
+SUMMARY_FIELDS = frozenset(("peer_address", "peer_state", "peer_as", "flap_count",
+                            "received_prefixes", "active_prefixes"))
+
+# Packed IPv6 addresses carry this bit so they sort after IPv4
+IPV6_FLAG = 1 << 128
+
+
+def local_name(tag):
+    """
+    Strip any XML namespace from a tag name.
+    """
+    return tag.rsplit("}", 1)[-1]
+
+
+def strip_port(address):
+    """
+    Junos reports peer addresses as "10.0.0.1+179"; drop the port.
+    """
+    return address.split("+", 1)[0] if address else address
+
+
+def iter_chunks(text, size=CHUNK_SIZE):
+    """
+    Split a reply into chunks for the incremental parser.
+    """
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+
+def raise_rpc_error(elem):
+    """
+    Raise RpcReplyError for an <rpc-error> element of error severity.
+    Warnings pass silently.
+    """
+    details = {local_name(c.tag): (c.text or "").strip() for c in elem}
+    if details.get("error-severity", "error") == "error":
+        raise RpcReplyError(details.get("error-message") or "RPC error")
+
+
+def iter_elements(chunks, release=()):
+    """
+    Stream (local name, element) for every element of a reply as it closes.
+
+    Elements named in release are detached from their parent once the
+    caller moves on, so memory stays flat however many of them the reply
+    carries. An <rpc-error> is checked with raise_rpc_error() first.
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    stack = []
+
+    def drain():
+        for event, elem in parser.read_events():
+            if event == "start":
+                stack.append(elem)
+                continue
+
+            stack.pop()
+            name = local_name(elem.tag)
+            if name == "rpc-error":
+                raise_rpc_error(elem)
+            yield name, elem
+            if name in release and stack:
+                stack[-1].remove(elem)
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from drain()
+    parser.close()
+    yield from drain()
+
+
+def pack_address(address):
+    """
+    Pack an IPv4/IPv6 address string into a single int.
+
+    A link-local scope ("fe80::1%ge-0/0/0.0") is dropped. None and text
+    that is no address at all, such as "unspecified", pack to None.
+    """
+    if not address:
+        return None
+    address = address.partition("%")[0]
+    try:
+        if ":" in address:
+            return int.from_bytes(socket.inet_pton(socket.AF_INET6, address), "big") | IPV6_FLAG
+        return int.from_bytes(socket.inet_aton(address), "big")
+    except OSError:
+        return None
+
+
+def unpack_address(packed):
+    """
+    Turn a packed address back into its string form.
+    """
+    if packed is None:
+        return None
+    if packed & IPV6_FLAG:
+        return socket.inet_ntop(socket.AF_INET6, (packed ^ IPV6_FLAG).to_bytes(16, "big"))
+    return socket.inet_ntoa(packed.to_bytes(4, "big"))
+
+
+def intern_text(value):
+    return sys.intern(value) if value else None
+
+
+class BgpPeer:
+    """
+    Compact record of one BGP session.
+
+    Addresses are stored as packed ints and repeated strings (device,
+    state, type, group) are interned, so a fleet's worth of peers costs a
+    fraction of the equivalent dicts. Read-only dict-style access (get(),
+    [], keys()) keeps the record usable wherever a peer dict was.
+    """
+
+    __slots__ = (
+        "device", "peer_ip", "local_ip", "peer_state", "peer_type", "peer_group",
+        "description", "received_prefixes", "active_prefixes", "peer_as", "local_as",
+        "flap_count", "routing_instance",
+    )
+
+    def __init__(self, device, peer_ip, local_ip, peer_state, peer_type, peer_group,
+                 description, received_prefixes, active_prefixes, peer_as, local_as, flap_count,
+                 routing_instance=None):
+        self.device = intern_text(device)
+        self.peer_ip = peer_ip
+        self.local_ip = local_ip
+        self.peer_state = intern_text(peer_state)
+        self.peer_type = intern_text(peer_type)
+        self.peer_group = intern_text(peer_group)
+        self.description = description
+        self.received_prefixes = received_prefixes
+        self.active_prefixes = active_prefixes
+        self.peer_as = peer_as
+        self.local_as = local_as
+        self.flap_count = flap_count
+        self.routing_instance = intern_text(routing_instance)
+
+    @property
+    def peer_address(self):
+        return unpack_address(self.peer_ip)
+
+    @property
+    def local_address(self):
+        return unpack_address(self.local_ip)
+
+    def astuple(self):
+        """
+        Return every field except device, addresses still packed.
+        """
+        return tuple(getattr(self, name) for name in self.__slots__[1:])
+
+    @classmethod
+    def from_tuple(cls, device, values):
+        return cls(device, *values)
+
+    def keys(self):
+        return PEER_FIELDS
+
+    def __getitem__(self, name):
+        if name not in PEER_FIELDS:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def get(self, name, default=None):
+        return getattr(self, name, default) if name in PEER_FIELDS else default
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in PEER_FIELDS}
+
+    def __repr__(self):
+        return f"BgpPeer({self.device} {self.peer_address} AS{self.peer_as} {self.peer_state})"
+
+
+def parse_fields(text):
+    """
+    Turn a comma-separated field list into a frozenset, or None for all fields.
+    """
+    if not text:
+        return None
+    fields = frozenset(field.strip() for field in text.split(",") if field.strip())
+    unknown = fields - set(PEER_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown BGP field(s): {', '.join(sorted(unknown))} (choose from: {', '.join(PEER_FIELDS)})")
+    return fields
+
+
+def bgp_rpc(fields=None):
+    """
+    Pick the smallest RPC whose reply carries every requested field.
+
+    Junos operational RPCs take no subtree filter, so projection means
+    asking for the summary table when it is enough.
+    """
+    if fields is not None and fields <= SUMMARY_FIELDS:
+        return BGP_SUMMARY_RPC
+    return BGP_NEIGHBOR_RPC
+
+
+def make_peer(device, values, received, active):
+    """
+    Build a BgpPeer from raw <bgp-peer> leaf texts and summed prefix counts.
+    """
+    numbers = {}
+    for name in INT_FIELDS:
+        value = values.get(name)
+        numbers[name] = int(value) if value and value.isdigit() else None
+
+    return BgpPeer(
+        device,
+        pack_address(strip_port(values.get("peer-address"))),
+        pack_address(strip_port(values.get("local-address"))),
+        values.get("peer-state"),
+        values.get("peer-type"),
+        values.get("peer-group"),
+        values.get("description") or None,
+        received,
+        active,
+        numbers["peer-as"],
+        numbers["local-as"],
+        numbers["flap-count"],
+        values.get("peer-cfg-rti") or None,
+    )
+
+
+def peer_record(peer, device=None):
+    """
+    Decode a <bgp-peer> element into a BgpPeer.
+    """
+    values = {}
+    received = active = 0
+    for child in peer:
+        name = local_name(child.tag)
+        if name == "bgp-rib":
+            for counter in child:
+                counter_name = local_name(counter.tag)
+                if counter_name == "received-prefix-count":
+                    received += int(counter.text or 0)
+                elif counter_name == "active-prefix-count":
+                    active += int(counter.text or 0)
+        elif len(child) == 0:
+            values[name] = (child.text or "").strip()
+    return make_peer(device, values, received, active)
+
+
+def iter_projected_peers(chunks, device=None, fields=SUMMARY_FIELDS):
+    """
+    Parse only the requested fields out of a neighbor or summary reply.
+
+    Runs on raw expat callbacks: no element objects are built, and text is
+    only collected for the wanted children of each <bgp-peer>, so parse
+    time follows the fields asked for rather than the size of the reply.
+    Unrequested fields are left as None.
+    """
+    wanted = {FIELD_ELEMENTS[field] for field in fields}
+    counters = {
+        element: field for element, field in (("received-prefix-count", "received_prefixes"),
+                                              ("active-prefix-count", "active_prefixes"))
+        if field in fields
+    }
+    done = []
+    state = {"depth": 0, "peer": None, "rib": False, "error": None, "capture": None}
+    values, counts, error, text = {}, {}, {}, []
+
+    def start(tag, attrs):
+        state["depth"] += 1
+        depth, peer = state["depth"], state["peer"]
+        name = tag.rpartition("}")[2]
+        if peer is None:
+            if name == "bgp-peer":
+                state["peer"] = depth
+                values.clear()
+                counts.update(dict.fromkeys(counters.values(), 0))
+            elif name == "rpc-error":
+                state["error"] = depth
+                error.clear()
+            elif state["error"] is not None and depth == state["error"] + 1:
+                state["capture"] = name
+                text.clear()
+        elif depth == peer + 1:
+            if name == "bgp-rib":
+                state["rib"] = bool(counters)
+            elif name in wanted:
+                state["capture"] = name
+                text.clear()
+        elif state["rib"] and depth == peer + 2 and name in counters:
+            state["capture"] = name
+            text.clear()
+
+    def end(tag):
+        depth = state["depth"]
+        state["depth"] -= 1
+        name = tag.rpartition("}")[2]
+        capture = state["capture"]
+        if capture == name:
+            state["capture"] = None
+            value = "".join(text).strip()
+            if state["peer"] is None:
+                error[name] = value
+            elif name in counters:
+                counts[counters[name]] += int(value or 0)
+            else:
+                values[name] = value
+        elif name == "bgp-rib":
+            state["rib"] = False
+        elif depth == state["peer"]:
+            state["peer"] = None
+            done.append(make_peer(device, values, counts.get("received_prefixes"), counts.get("active_prefixes")))
+        elif depth == state["error"]:
+            state["error"] = None
+            if error.get("error-severity", "error") == "error":
+                raise RpcReplyError(error.get("error-message") or "RPC error")
+
+    def data(chunk):
+        if state["capture"]:
+            text.append(chunk)
+
+    parser = expat.ParserCreate(namespace_separator="}")
+    parser.buffer_text = True
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = data
+
+    for chunk in chunks:
+        parser.Parse(chunk, False)
+        yield from done
+        done.clear()
+    parser.Parse("", True)
+    yield from done
+
+
+def iter_bgp_peers(chunks, device=None, fields=None):
+    """
+    Incrementally parse a get-bgp-neighbor-information reply.
+
+    Yields one BgpPeer per <bgp-peer> as soon as its closing tag has been
+    read. Each decoded element is detached from its parent, so memory use
+    stays flat however many peers the reply carries. Works on both the
+    neighbor and the summary reply; with fields, only those are decoded
+    (see iter_projected_peers()).
+    """
+    if fields is not None:
+        yield from iter_projected_peers(chunks, device, fields)
+        return
+
+    for name, elem in iter_elements(chunks, release=("bgp-peer",)):
+        if name == "bgp-peer":
+            yield peer_record(elem, device)
+
+
+def parse_bgp_reply(reply, fields=None):
+    """
+    Parse a whole reply into BgpPeer.astuple() tuples.
+
+    Meant to run in a worker process: bare tuples of ints and short
+    strings pickle far smaller and faster than objects on the way back.
+    """
+    return [peer.astuple() for peer in iter_bgp_peers(iter_chunks(reply), fields=fields)]
+
+
+def start_parser_pool(processes):
+    """
+    Start worker processes for reply parsing.
+
+    Workers are forked immediately, so call this before any I/O threads
+    exist. fork also keeps the interactive scripts from being re-imported
+    in every worker, so other start methods are not supported.
+    """
+    if "fork" not in multiprocessing.get_all_start_methods():
+        raise ValueError("Parsing in worker processes needs the 'fork' start method")
+    executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("fork"))
+    executor.submit(int).result()
+    return executor
+
+
+def parse_peers(reply, device, parser_pool=None, metrics=None, fields=None):
+    """
+    Decode a get-bgp-neighbor-information reply into peer records.
+
+    With a parser_pool the reply is parsed in a worker process, keeping
+    CPU-heavy XML decoding off the threads that drive SSH.
+    """
+    host, site = device["host"], device.get("site")
+    if parser_pool is not None:
+        with timed(metrics, host, "parse", site):
+            rows = parser_pool.submit(parse_bgp_reply, reply, fields).result()
+        return (BgpPeer.from_tuple(host, row) for row in rows)
+
+    peers = iter_bgp_peers(iter_chunks(reply), host, fields)
+    if metrics:
+        return metrics.timed_iter(host, "parse", peers, site)
+    return peers
+
+
+def fetch_bgp_peers(pool, device, parser_pool=None, fields=None):
+    """
+    Fetch device's BGP peers, limited to fields if given.
+
+    Uses get-bgp-summary-information when it carries every requested
+    field, and get-bgp-neighbor-information otherwise.
+    """
+    reply = pool.rpc(device, bgp_rpc(fields))
+    return parse_peers(reply, device, parser_pool, pool.metrics, fields)
+
+
+def fetch_bgp_peer(pool, device, address, fields=None):
+    """
+    Fetch the session(s) device has with one peer address, as a list.
+    """
+    reply = pool.rpc(device, BGP_PEER_RPC.format(address=address))
+    return list(parse_peers(reply, device, None, pool.metrics, fields))
+
+
+def fetch_bundle(pool, device, rpcs=None):
+    """
+    Pipeline a bundle of RPCs (STANDARD_BUNDLE by default) on one session.
+
+    Returns the raw replies by name.
+    """
+    return pool.rpc_bundle(device, rpcs or STANDARD_BUNDLE)
@@ -0,0 +1,185 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+
+# Cache defaults
+CACHE_TTL = 60
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+MEMORY_BYTES = 16 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rpc_cache (
+    key TEXT PRIMARY KEY,
+    host TEXT NOT NULL,
+    stored_at REAL NOT NULL,
+    used_at REAL NOT NULL,
+    size INTEGER NOT NULL,
+    reply BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_rpc_cache_used_at ON rpc_cache (used_at);
+CREATE TABLE IF NOT EXISTS rpc_cache_meta (
+    name TEXT PRIMARY KEY,
+    value BLOB NOT NULL
+);
+"""
+
+
+def cache_key(device, rpc, salt):
+    """
+    Key a reply by the device, port, user, password and exact RPC text.
+
+    The salt is kept in the cache file, so keys stay the same across runs
+    but the password cannot be guessed from them elsewhere.
+    """
+    fields = (device["host"], device.get("port", 830), device["user"], device.get("password"), rpc)
+    return hashlib.blake2b("\0".join(map(str, fields)).encode(), key=salt).hexdigest()
+
+
+class RpcCache:
+    """
+    Raw RPC replies kept for ttl seconds, in memory and in an SQLite file.
+
+    Replies read back from the file stay in an in-process LRU of up to
+    memory_bytes characters; stored replies go only to the file, so a
+    fleet run that never repeats an RPC keeps none of them in memory. The
+    file keeps compressed replies across runs and evicts the least
+    recently used ones once they exceed max_bytes. It and its WAL files
+    are readable only by their owner, as replies may describe the network
+    in detail.
+    """
+
+    def __init__(self, path=".rpc_cache.db", ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES,
+                 memory_bytes=MEMORY_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        # SQLite opens existing -wal and -shm files instead of creating them
+        for name in (path, f"{path}-wal", f"{path}-shm"):
+            os.close(os.open(name, os.O_WRONLY | os.O_CREAT, 0o600))
+            os.chmod(name, 0o600)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        with self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO rpc_cache_meta VALUES ('salt', ?)", (os.urandom(16),))
+        self.salt = self.conn.execute("SELECT value FROM rpc_cache_meta WHERE name = 'salt'").fetchone()[0]
+        self.hits = self.misses = 0
+
+    def _remember(self, key, stored_at, reply):
+        self._forget(key)
+        if len(reply) > self.memory_bytes:
+            return
+        self._memory[key] = (stored_at, reply)
+        self._memory_size += len(reply)
+        while self._memory_size > self.memory_bytes:
+            self._memory_size -= len(self._memory.popitem(last=False)[1][1])
+
+    def _forget(self, key):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_size -= len(entry[1])
+
+    def get(self, device, rpc):
+        """
+        Return the cached reply for rpc on device, or None if absent or expired.
+        """
+        key = cache_key(device, rpc, self.salt)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                row = self.conn.execute(
+                    "SELECT stored_at, reply FROM rpc_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    entry = (row[0], zlib.decompress(row[1]).decode())
+                    self._remember(key, *entry)
+            if entry is None or now - entry[0] > self.ttl:
+                self.misses += 1
+                return None
+            if key in self._memory:
+                self._memory.move_to_end(key)
+            self.conn.execute("UPDATE rpc_cache SET used_at = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.hits += 1
+            return entry[1]
+
+    def put(self, device, rpc, reply):
+        """
+        Store a reply, evicting the least recently used ones if over size.
+        """
+        key = cache_key(device, rpc, self.salt)
+        now = time.time()
+        blob = zlib.compress(reply.encode(), 1)
+        with self._lock:
+            self._forget(key)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO rpc_cache (key, host, stored_at, used_at, size, reply) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, device["host"], now, now, len(blob), blob),
+            )
+            self._evict(now)
+            self.conn.commit()
+
+    def _evict(self, now):
+        self.conn.execute("DELETE FROM rpc_cache WHERE stored_at < ?", (now - self.ttl,))
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM rpc_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.conn.execute("SELECT key, size FROM rpc_cache ORDER BY used_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM rpc_cache WHERE key = ?", (key,))
+            self._forget(key)
+            total -= size
+
+    def close(self):
+        self.conn.close()
+
+
+class CachingPool:
+    """
+    Wrap a session pool (or BrokerClient) so repeated RPCs are answered
+    from an RpcCache. Replies carrying an rpc-error are never cached.
+    """
+
+    def __init__(self, pool, cache):
+        self.pool = pool
+        self.cache = cache
+        self.metrics = pool.metrics
+
+    def rpc(self, device, rpc):
+        return self.rpc_bundle(device, {"reply": rpc})["reply"]
+
+    def rpc_bundle(self, device, rpcs):
+        replies, missing = {}, {}
+        for name, rpc in rpcs.items():
+            reply = self.cache.get(device, rpc)
+            if reply is None:
+                missing[name] = rpc
+            else:
+                replies[name] = reply
+        if missing:
+            fetched = self.pool.rpc_bundle(device, missing)
+            for name, reply in fetched.items():
+                if "rpc-error>" not in reply:
+                    self.cache.put(device, missing[name], reply)
+            replies.update(fetched)
+        return {name: replies[name] for name in rpcs}
+
+    def discard(self, device):
+        self.pool.discard(device)
+
+    def close_all(self):
+        self.pool.close_all()
+        self.cache.close()
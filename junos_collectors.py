@@ -0,0 +1,147 @@
+from junos_bgp import STANDARD_BUNDLE, iter_chunks, iter_elements, local_name, parse_peers
+from junos_sessions import RpcReplyError
+
+# RPCs collectors can ask for, by name. Collectors naming the same RPC share its reply.
+RPCS = dict(
+    STANDARD_BUNDLE,
+    ospf_neighbors="<get-ospf-neighbor-information/>",
+    lldp_neighbors="<get-lldp-neighbors-information/>",
+)
+
+
+class Collector:
+    """
+    One kind of device data: the RPCs it needs and how to decode them.
+
+    parse(replies, device, parser_pool) receives the device's ReplyCache
+    and returns an iterable of records.
+    """
+
+    def __init__(self, name, rpcs, parse):
+        self.name = name
+        self.rpcs = tuple(rpcs)
+        self.parse = parse
+
+
+# Registered collectors by name
+COLLECTORS = {}
+
+
+def register_collector(name, *rpcs):
+    """
+    Decorator registering a parse function as the collector for name.
+    """
+    def decorator(parse):
+        COLLECTORS[name] = Collector(name, rpcs, parse)
+        return parse
+    return decorator
+
+
+class ReplyCache:
+    """
+    Raw RPC replies of one device, each fetched at most once.
+
+    fetch() pipelines every missing RPC in a single bundle on the device's
+    pooled session.
+    """
+
+    def __init__(self, pool, device):
+        self.pool = pool
+        self.device = device
+        self.replies = {}
+
+    def fetch(self, names):
+        missing = {name: RPCS[name] for name in names if name not in self.replies}
+        if missing:
+            self.replies.update(self.pool.rpc_bundle(self.device, missing))
+
+    def __getitem__(self, name):
+        self.fetch((name,))
+        return self.replies[name]
+
+
+def iter_records(reply, tag):
+    """
+    Stream the elements named tag out of a reply as dicts of their leaf
+    children, with dashes in field names turned into underscores.
+    """
+    for name, elem in iter_elements(iter_chunks(reply), release=(tag,)):
+        if name == tag:
+            yield {
+                local_name(child.tag).replace("-", "_"): (child.text or "").strip()
+                for child in elem if len(child) == 0
+            }
+
+
+def iter_interface_addresses(reply):
+    """
+    Stream {"interface", "family", "address"} records for every address
+    configured on a logical interface in a get-interface-information reply.
+    """
+    def children(elem, name):
+        return (child for child in elem if local_name(child.tag) == name)
+
+    def text(elem, name):
+        return next(((child.text or "").strip() for child in children(elem, name)), "")
+
+    release = ("logical-interface", "physical-interface")
+    for name, elem in iter_elements(iter_chunks(reply), release):
+        if name == "logical-interface":
+            interface = text(elem, "name")
+            for family in children(elem, "address-family"):
+                family_name = text(family, "address-family-name")
+                for address in children(family, "interface-address"):
+                    local = text(address, "ifa-local")
+                    if local:
+                        yield {"interface": interface, "family": family_name, "address": local}
+
+
+@register_collector("bgp", "bgp_neighbors")
+def collect_bgp(replies, device, parser_pool=None):
+    return parse_peers(replies["bgp_neighbors"], device, parser_pool, replies.pool.metrics)
+
+
+@register_collector("ospf", "ospf_neighbors")
+def collect_ospf(replies, device, parser_pool=None):
+    return iter_records(replies["ospf_neighbors"], "ospf-neighbor")
+
+
+@register_collector("interfaces", "interfaces")
+def collect_interfaces(replies, device, parser_pool=None):
+    return iter_records(replies["interfaces"], "physical-interface")
+
+
+@register_collector("addresses", "interfaces")
+def collect_addresses(replies, device, parser_pool=None):
+    return iter_interface_addresses(replies["interfaces"])
+
+
+@register_collector("lldp", "lldp_neighbors")
+def collect_lldp(replies, device, parser_pool=None):
+    return iter_records(replies["lldp_neighbors"], "lldp-neighbor-information")
+
+
+@register_collector("route_summary", "route_summary")
+def collect_route_summary(replies, device, parser_pool=None):
+    return iter_records(replies["route_summary"], "route-table")
+
+
+def run_collectors(pool, device, names, parser_pool=None):
+    """
+    Run the named collectors against device on one session.
+
+    All the RPCs they need are fetched in one pipelined bundle, once each.
+    Returns (results, errors): records by collector name, and the error
+    of every collector whose reply could not be decoded.
+    """
+    collectors = [COLLECTORS[name] for name in names]
+    replies = ReplyCache(pool, device)
+    replies.fetch(dict.fromkeys(rpc for collector in collectors for rpc in collector.rpcs))
+
+    results, errors = {}, {}
+    for collector in collectors:
+        try:
+            results[collector.name] = list(collector.parse(replies, device, parser_pool))
+        except RpcReplyError as e:
+            errors[collector.name] = e
+    return results, errors
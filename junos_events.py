@@ -0,0 +1,142 @@
+import queue
+import re
+import threading
+
+from junos_fleet import GOVERNOR_POLL
+from junos_sessions import session_key
+
+# Subscription defaults
+NOTIFICATION_WAIT = 1.0
+RESUBSCRIBE_DELAY = 5
+MAX_RESUBSCRIBE_DELAY = 300
+
+# The text of a BGP_NEIGHBOR_STATE_CHANGED event, e.g.
+# "BGP peer 10.0.0.1 (External AS 65001) changed state from Established to Idle (event HoldTime)"
+STATE_CHANGE = re.compile(
+    r"BGP peer ([0-9A-Fa-f.:]+?)(?:\+\d+)? \([^)]*\) changed state from (\w+) to (\w+)"
+)
+
+
+def parse_bgp_event(notification):
+    """
+    Return (peer address, old state, new state) from a notification's XML,
+    or None if it is not a BGP peer state change.
+    """
+    match = STATE_CHANGE.search(notification)
+    return match.groups() if match else None
+
+
+class BgpSubscriber:
+    """
+    Hold a NETCONF notification subscription open to each started device
+    and queue the BGP peer state changes it reports.
+
+    Every device gets its own session, opened outside the pool, and a
+    thread waiting on it, so an idle subscription costs the device nothing
+    but SSH keep-alives. events receives (device, peer address, old state,
+    new state). A subscription that drops is reopened after a growing
+    delay; events sent meanwhile are lost, so (device, None, None, None)
+    is queued once it is back to ask for a full poll.
+
+    With a SiteGovernor, opening a subscription takes the device's site
+    slot like a poll does, so handshakes respect the site limits. The slot
+    is given back once the subscription is open: open subscriptions are
+    idle and are capped neither by the governor nor by a session limit.
+    """
+
+    def __init__(self, pool, stream=None, resubscribe_delay=RESUBSCRIBE_DELAY,
+                 max_resubscribe_delay=MAX_RESUBSCRIBE_DELAY, governor=None):
+        self.pool = pool
+        self.stream = stream
+        self.governor = governor
+        self.resubscribe_delay = resubscribe_delay
+        self.max_resubscribe_delay = max_resubscribe_delay
+        self.events = queue.Queue()
+        self.errors = queue.Queue()
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = {}
+
+    def start(self, device):
+        """
+        Subscribe to device unless it already is.
+        """
+        key = session_key(device)
+        with self._lock:
+            if key in self._threads or self._stopped.is_set():
+                return
+            thread = threading.Thread(target=self._run, args=(device,), name=f"subscribe-{device['host']}",
+                                      daemon=True)
+            self._threads[key] = thread
+        thread.start()
+
+    def _admit(self, device):
+        """
+        Wait until the governor lets device open a session. Returns False
+        if the subscriber is closed first.
+        """
+        while True:
+            delay = self.governor.try_acquire(device)
+            if delay == 0:
+                return True
+            if self._stopped.wait(GOVERNOR_POLL if delay is None else min(delay, GOVERNOR_POLL)):
+                return False
+
+    def _subscribe(self, device):
+        if self.governor and not self._admit(device):
+            return None
+        try:
+            # ncclient's junos handler takes every message for an
+            # rpc-reply and drops the session on the first notification
+            conn = self.pool.connect(device, device_params={"name": "default"})
+            try:
+                conn.create_subscription(stream_name=self.stream)
+            except Exception:
+                conn.close_session()
+                raise
+            return conn
+        finally:
+            if self.governor:
+                self.governor.release(device)
+
+    def _run(self, device):
+        delay = self.resubscribe_delay
+        reconnecting = False
+        while not self._stopped.is_set():
+            conn = None
+            try:
+                conn = self._subscribe(device)
+                if conn is None:
+                    break
+                if reconnecting:
+                    self.events.put((device, None, None, None))
+                delay = self.resubscribe_delay
+                while not self._stopped.is_set() and conn.connected:
+                    notification = conn.take_notification(block=True, timeout=NOTIFICATION_WAIT)
+                    if notification is None:
+                        continue
+                    event = parse_bgp_event(notification.notification_xml)
+                    if event:
+                        self.events.put((device, *event))
+            except Exception as e:
+                self.errors.put((device, e))
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close_session()
+                    except Exception:
+                        pass
+            reconnecting = True
+            if self._stopped.wait(delay):
+                break
+            delay = min(delay * 2, self.max_resubscribe_delay)
+
+    def close(self):
+        """
+        End every subscription and wait for the threads to finish.
+        """
+        self._stopped.set()
+        with self._lock:
+            threads = list(self._threads.values())
+        for thread in threads:
+            thread.join(NOTIFICATION_WAIT * 2)
@@ -0,0 +1,304 @@
+import errno
+import json
+import os
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Defaults for fleet-wide runs
+MAX_WORKERS = 20
+CONNECT_TIMEOUT = 15
+RPC_TIMEOUT = 60
+
+# Reachability probe and circuit breaker defaults
+PROBE_TIMEOUT = 2
+PROBE_BATCH = 512
+BREAKER_COOLDOWN = 300
+BREAKER_MAX_COOLDOWN = 3600
+
+# Longest the dispatcher sleeps while every waiting site is throttled
+GOVERNOR_POLL = 1.0
+
+# connect_ex() results meaning the connection is done or under way
+CONNECT_STARTED = (0, errno.EINPROGRESS, getattr(errno, "WSAEWOULDBLOCK", errno.EWOULDBLOCK))
+
+
+class TokenBucket:
+    """
+    Allow rate operations per second on average, in bursts of up to burst.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    def wait_time(self, now):
+        """
+        Seconds until a token is available (0 if one is available now).
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class SiteGovernor:
+    """
+    Limit how hard device operations hit each site.
+
+    Every site gets at most site_sessions operations in flight, every
+    (site, category) pair at most category_sessions, and new operations
+    start at no more than site_rate per second per site (in bursts of
+    site_burst). A limit of None is unlimited. Devices are keyed by the
+    "site" and "category" the compiled inventory gives them.
+    """
+
+    def __init__(self, site_sessions=None, category_sessions=None, site_rate=None, site_burst=1):
+        self.site_sessions = site_sessions
+        self.category_sessions = category_sessions
+        self.site_rate = site_rate
+        self.site_burst = site_burst
+        self._lock = threading.Lock()
+        self._sites = {}
+        self._categories = {}
+        self._buckets = {}
+
+    @staticmethod
+    def keys(device):
+        site = device.get("site") or "unknown"
+        return site, (site, device.get("category") or "unknown")
+
+    def try_acquire(self, device):
+        """
+        Claim a slot for device without blocking.
+
+        Returns 0 once the slot is taken, the seconds until the site's rate
+        limit allows another start, or None while the site or category is
+        at its in-flight limit (a release is needed first).
+        """
+        site, category = self.keys(device)
+        with self._lock:
+            if self.site_sessions is not None and self._sites.get(site, 0) >= self.site_sessions:
+                return None
+            if self.category_sessions is not None and self._categories.get(category, 0) >= self.category_sessions:
+                return None
+            if self.site_rate:
+                bucket = self._buckets.get(site)
+                if bucket is None:
+                    bucket = self._buckets[site] = TokenBucket(self.site_rate, self.site_burst)
+                delay = bucket.wait_time(time.monotonic())
+                if delay:
+                    return delay
+                bucket.take()
+            self._sites[site] = self._sites.get(site, 0) + 1
+            self._categories[category] = self._categories.get(category, 0) + 1
+            return 0
+
+    def release(self, device):
+        site, category = self.keys(device)
+        with self._lock:
+            self._sites[site] -= 1
+            self._categories[category] -= 1
+
+
+def add_governor_args(parser):
+    """
+    Add the --site-sessions, --category-sessions, --site-rate and
+    --site-burst options read by governor_from_args().
+    """
+    parser.add_argument("--site-sessions", type=int,
+                        help="Devices processed at the same time at any one site (default: no limit)")
+    parser.add_argument("--category-sessions", type=int,
+                        help="Devices processed at the same time in any one site category (default: no limit)")
+    parser.add_argument("--site-rate", type=float,
+                        help="New devices started per second at any one site (default: no limit)")
+    parser.add_argument("--site-burst", type=int, default=1,
+                        help="Devices a site may start back to back under --site-rate (default: 1)")
+
+
+def governor_from_args(args):
+    """
+    Return a SiteGovernor for the parsed governor options, or None if
+    none of them sets a limit.
+    """
+    if args.site_sessions or args.category_sessions or args.site_rate:
+        return SiteGovernor(args.site_sessions, args.category_sessions, args.site_rate, args.site_burst)
+    return None
+
+
+def iter_fleet(devices, task, max_workers=MAX_WORKERS, governor=None):
+    """
+    Run task(device) for every device with at most max_workers in flight.
+
+    Yields (device, result, error) tuples in the same order as devices,
+    each as soon as it and every device before it have finished.
+
+    With a SiteGovernor, the calling thread dispatches devices round-robin
+    across (site, category) groups and only hands a worker a device whose
+    site can take it, so a throttled site never ties up workers that
+    another site could use.
+    """
+    devices = list(devices)
+    if not devices:
+        return
+
+    def safe_task(device):
+        try:
+            return device, task(device), None
+        except Exception as e:
+            return device, None, e
+        finally:
+            if governor:
+                governor.release(device)
+
+    workers = max(1, min(max_workers, len(devices)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        if governor is None:
+            yield from executor.map(safe_task, devices)
+            return
+
+        groups = {}
+        for position, device in enumerate(devices):
+            groups.setdefault(governor.keys(device)[1], deque()).append(position)
+        results = {}
+        inflight = {}
+        next_position = 0
+
+        while groups or inflight:
+            # Keep admitting one device per group until nothing more fits
+            retry_in = GOVERNOR_POLL
+            progress = True
+            while progress and len(inflight) < workers:
+                progress = False
+                for key in list(groups):
+                    if len(inflight) >= workers:
+                        break
+                    queue = groups[key]
+                    delay = governor.try_acquire(devices[queue[0]])
+                    if delay != 0:
+                        if delay is not None:
+                            retry_in = min(retry_in, delay)
+                        continue
+                    position = queue.popleft()
+                    inflight[executor.submit(safe_task, devices[position])] = position
+                    progress = True
+                    if not queue:
+                        del groups[key]
+
+            if inflight:
+                done, _ = wait(inflight, timeout=retry_in, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[inflight.pop(future)] = future.result()
+            else:
+                time.sleep(retry_in)
+
+            while next_position in results:
+                yield results.pop(next_position)
+                next_position += 1
+
+
+def probe_reachable(devices, timeout=PROBE_TIMEOUT, batch=PROBE_BATCH):
+    """
+    TCP-connect to every device's NETCONF port at once.
+
+    Connects are non-blocking and multiplexed with selectors, batch at a
+    time, so a whole fleet is probed in about timeout seconds. Returns
+    the set of hosts that accepted a connection.
+    """
+    reachable = set()
+    devices = list(devices)
+    for start in range(0, len(devices), batch):
+        selector = selectors.DefaultSelector()
+        try:
+            for device in devices[start:start + batch]:
+                host, port = device["host"], device.get("port", 830)
+                try:
+                    family, kind, proto, _, address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0]
+                    sock = socket.socket(family, kind, proto)
+                except OSError:
+                    continue
+                sock.setblocking(False)
+                if sock.connect_ex(address) not in CONNECT_STARTED:
+                    sock.close()
+                    continue
+                selector.register(sock, selectors.EVENT_WRITE, host)
+
+            deadline = time.monotonic() + timeout
+            while selector.get_map():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                for key, _ in selector.select(remaining):
+                    sock = key.fileobj
+                    if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                        reachable.add(key.data)
+                    selector.unregister(sock)
+                    sock.close()
+        finally:
+            for key in list(selector.get_map().values()):
+                key.fileobj.close()
+            selector.close()
+    return reachable
+
+
+class CircuitBreaker:
+    """
+    Remember devices that failed recently and skip them until a cool-down.
+
+    Each consecutive failure doubles the cool-down, up to max_cooldown.
+    State is kept in a JSON file so it carries across runs.
+    """
+
+    def __init__(self, path=".circuit_breaker.json", cooldown=BREAKER_COOLDOWN,
+                 max_cooldown=BREAKER_MAX_COOLDOWN):
+        self.path = path
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r") as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            self.state = {}
+
+    def allow(self, host):
+        """
+        Return True unless host failed recently and is still cooling down.
+        """
+        with self._lock:
+            entry = self.state.get(host)
+            return entry is None or time.time() >= entry["open_until"]
+
+    def retry_in(self, host):
+        """
+        Seconds until host may be tried again.
+        """
+        with self._lock:
+            entry = self.state.get(host)
+            return max(0, entry["open_until"] - time.time()) if entry else 0
+
+    def record_failure(self, host):
+        with self._lock:
+            entry = self.state.setdefault(host, {"failures": 0, "open_until": 0})
+            entry["failures"] += 1
+            entry["open_until"] = time.time() + min(
+                self.cooldown * 2 ** (entry["failures"] - 1), self.max_cooldown
+            )
+
+    def record_success(self, host):
+        with self._lock:
+            self.state.pop(host, None)
+
+    def save(self):
+        with self._lock:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.state, f)
+            os.replace(tmp_path, self.path)
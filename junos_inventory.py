@@ -0,0 +1,162 @@
+import hashlib
+import os
+import pickle
+
+from junos_lib import JunosInventoryManager
+
+# Bump when the compiled layout changes so stale caches are rebuilt
+CACHE_VERSION = 2
+
+
+class CompiledInventory:
+    """
+    Flattened site -> category -> device inventory with prebuilt indexes.
+
+    Every device dict gains "site" and "category" keys. Lookups by host,
+    site, category and tag only touch the devices they return.
+    """
+
+    def __init__(self, inventory):
+        self.devices = []
+        self.by_host = {}
+        self.by_site = {}
+        self.by_category = {}
+        self.by_site_category = {}
+        self.by_tag = {}
+        self.layout = {}
+
+        for site, categories in (inventory or {}).items():
+            self.layout[site] = list(categories or {})
+            for category, devices in (categories or {}).items():
+                for device in devices or []:
+                    device = dict(device, site=site, category=category)
+                    index = len(self.devices)
+                    self.devices.append(device)
+                    self.by_host.setdefault(device["host"], []).append(index)
+                    self.by_site.setdefault(site, []).append(index)
+                    self.by_category.setdefault(category, []).append(index)
+                    self.by_site_category.setdefault((site, category), []).append(index)
+                    for tag in device_tags(device):
+                        self.by_tag.setdefault(tag, []).append(index)
+
+    def __len__(self):
+        return len(self.devices)
+
+    def sites(self):
+        return list(self.layout)
+
+    def categories(self, site):
+        return list(self.layout.get(site, []))
+
+    def get(self, host):
+        """
+        Return the first device with this host name, or None. A host listed
+        under several sites or categories needs select() to pick one.
+        """
+        indexes = self.by_host.get(host)
+        return self.devices[indexes[0]] if indexes else None
+
+    def select(self, site=None, category=None, hosts=None, tags=None):
+        """
+        Return the devices matching every given filter, in inventory order.
+
+        The smallest matching index drives the scan, so the cost follows
+        the size of the result rather than the size of the inventory.
+        """
+        candidates = []
+        if hosts is not None:
+            candidates.append([i for h in hosts for i in self.by_host.get(h, ())])
+        if site is not None and category is not None:
+            candidates.append(self.by_site_category.get((site, category), []))
+        elif site is not None:
+            candidates.append(self.by_site.get(site, []))
+        elif category is not None:
+            candidates.append(self.by_category.get(category, []))
+        for tag in tags or []:
+            candidates.append(self.by_tag.get(tag, []))
+
+        if not candidates:
+            return list(self.devices)
+
+        candidates.sort(key=len)
+        smallest, rest = candidates[0], [set(c) for c in candidates[1:]]
+        return [
+            self.devices[i] for i in sorted(set(smallest))
+            if all(i in other for other in rest)
+        ]
+
+
+def device_tags(device):
+    """
+    Return a device's tags as a list, accepting a single string or a list.
+    """
+    tags = device.get("tags") or []
+    return [tags] if isinstance(tags, str) else list(tags)
+
+
+def file_digest(path):
+    """
+    Return the SHA-256 hex digest of a file's contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_inventory(path, cache_path=None):
+    """
+    Load the inventory at path, using a compiled cache when it is current.
+
+    The cache is trusted when the YAML file's mtime and size match. If they
+    differ but the content hash still matches, the cache is reused and its
+    stamp refreshed. Otherwise the YAML is parsed again through
+    JunosInventoryManager and the cache rewritten.
+    """
+    cache_path = cache_path or f"{path}.cache"
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return CompiledInventory({})
+    stamp = (stat.st_mtime_ns, stat.st_size)
+
+    cached = None
+    try:
+        with open(cache_path, "rb") as f:
+            cached = pickle.load(f)
+        if cached.get("version") != CACHE_VERSION:
+            cached = None
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        cached = None
+
+    if cached and cached["stamp"] == stamp:
+        return cached["inventory"]
+
+    digest = file_digest(path)
+    if cached and cached["digest"] == digest:
+        compiled = cached["inventory"]
+    else:
+        compiled = CompiledInventory(JunosInventoryManager(path).load_inventory())
+
+    try:
+        save_cache(cache_path, {
+            "version": CACHE_VERSION,
+            "stamp": stamp,
+            "digest": digest,
+            "inventory": compiled,
+        })
+    except OSError as e:
+        print(f"Warning: could not write inventory cache {cache_path}: {e}")
+    return compiled
+
+
+def save_cache(cache_path, payload):
+    """
+    Atomically write the compiled cache, readable only by its owner.
+    """
+    tmp_path = f"{cache_path}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Phases of a device operation, in the order they happen
+PHASES = ("tcp_connect", "ssh_setup", "rpc", "parse", "write", "close")
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "buckets": {str(bound): count for bound, count in zip(self.buckets, self.counts)},
+        }
+
+
+class PhaseMetrics:
+    """
+    Per-device phase timings aggregated into per-(site, phase) histograms.
+
+    Safe to share between the threads of a fleet run.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.devices = {}
+        self.errors = {}
+
+    def observe(self, host, phase, seconds, site=None):
+        """
+        Record that phase took seconds on host.
+        """
+        site = site or "unknown"
+        with self._lock:
+            histogram = self.histograms.get((site, phase))
+            if histogram is None:
+                histogram = self.histograms[(site, phase)] = Histogram()
+            histogram.observe(seconds)
+            timings = self.devices.setdefault(host, {"site": site, "phases": {}})["phases"]
+            timings[phase] = timings.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def time(self, host, phase, site=None):
+        """
+        Time the enclosed block as phase on host. Failures are counted too.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            with self._lock:
+                key = (site or "unknown", phase)
+                self.errors[key] = self.errors.get(key, 0) + 1
+            raise
+        finally:
+            self.observe(host, phase, time.perf_counter() - start, site)
+
+    def timed_iter(self, host, phase, iterable, site=None):
+        """
+        Yield from iterable, charging the time spent producing items to phase.
+        """
+        total = 0.0
+        iterator = iter(iterable)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    total += time.perf_counter() - start
+                yield item
+        finally:
+            self.observe(host, phase, total, site)
+
+    def to_json(self):
+        with self._lock:
+            return {
+                "phases": {
+                    f"{site}/{phase}": histogram.to_dict()
+                    for (site, phase), histogram in sorted(self.histograms.items())
+                },
+                "errors": {f"{site}/{phase}": count for (site, phase), count in sorted(self.errors.items())},
+                "devices": {
+                    host: {"site": data["site"],
+                           "phases": {phase: round(s, 6) for phase, s in data["phases"].items()}}
+                    for host, data in sorted(self.devices.items())
+                },
+            }
+
+    def to_prometheus(self):
+        """
+        Render the metrics in the Prometheus text exposition format.
+        """
+        lines = [
+            "# HELP junos_phase_seconds Time spent in each phase of a device operation.",
+            "# TYPE junos_phase_seconds histogram",
+        ]
+        with self._lock:
+            for (site, phase), histogram in sorted(self.histograms.items()):
+                labels = f'site="{site}",phase="{phase}"'
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(f'junos_phase_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'junos_phase_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f"junos_phase_seconds_sum{{{labels}}} {histogram.sum:.6f}")
+                lines.append(f"junos_phase_seconds_count{{{labels}}} {histogram.count}")
+
+            lines.append("# HELP junos_phase_errors_total Phase attempts that raised an error.")
+            lines.append("# TYPE junos_phase_errors_total counter")
+            for (site, phase), count in sorted(self.errors.items()):
+                lines.append(f'junos_phase_errors_total{{site="{site}",phase="{phase}"}} {count}')
+
+            lines.append("# HELP junos_device_phase_seconds Total time per phase for each device.")
+            lines.append("# TYPE junos_device_phase_seconds gauge")
+            for host, data in sorted(self.devices.items()):
+                for phase, seconds in data["phases"].items():
+                    lines.append(
+                        f'junos_device_phase_seconds{{host="{host}",site="{data["site"]}",phase="{phase}"}} '
+                        f"{seconds:.6f}"
+                    )
+        return "\n".join(lines) + "\n"
+
+    def write(self, prometheus_path=None, json_path=None):
+        """
+        Atomically write the Prometheus text file and/or the JSON file.
+        """
+        for path, render in ((prometheus_path, self.to_prometheus),
+                             (json_path, lambda: json.dumps(self.to_json(), indent=2))):
+            if not path:
+                continue
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(render())
+            os.replace(tmp_path, path)
+
+
+def timed(metrics, host, phase, site=None):
+    """
+    metrics.time(...) when metrics are enabled, otherwise a no-op context.
+    """
+    return metrics.time(host, phase, site) if metrics else nullcontext()
@@ -0,0 +1,258 @@
+import argparse
+import socket
+from array import array
+from collections import Counter
+
+from junos_bgp import iter_chunks, iter_elements
+
+try:
+    import numpy as np
+except ImportError:  # vectorized analysis is optional
+    np = None
+
+# Active paths only: one entry per destination keeps a full table small
+ROUTE_RPC = "<get-route-information><table>{table}</table><active-path/></get-route-information>"
+
+# Leaf elements of an <rt-entry> that route_fields() uses; the first <to>/<via> wins
+ROUTE_FIELDS = {"active-tag", "protocol-name", "to", "via", "nh-type"}
+
+# Protocol codes stored per route; anything else is "other"
+PROTOCOLS = ("other", "Direct", "Local", "Static", "BGP", "OSPF", "IS-IS", "Aggregate", "Access-internal")
+PROTOCOL_CODES = {name: code for code, name in enumerate(PROTOCOLS)}
+
+
+class RibTable:
+    """
+    One device's IPv4 routing table as packed columns.
+
+    network is the destination as an unsigned 32-bit int, length its prefix
+    length, next_hop an index into next_hops, protocol an index into
+    PROTOCOLS. A million routes take about 10 MB. With numpy installed,
+    columns() exposes the same buffers as arrays without copying.
+    """
+
+    def __init__(self, device=None):
+        self.device = device
+        self.network = array("I")
+        self.length = array("B")
+        self.next_hop = array("I")
+        self.protocol = array("B")
+        self.next_hops = []
+        self._next_hop_ids = {}
+        self.skipped = 0
+
+    def __len__(self):
+        return len(self.network)
+
+    def add(self, destination, next_hop, protocol):
+        address, _, length = destination.partition("/")
+        try:
+            packed = socket.inet_aton(address)
+        except OSError:
+            # Not an IPv4 destination
+            self.skipped += 1
+            return
+        hop_id = self._next_hop_ids.get(next_hop)
+        if hop_id is None:
+            hop_id = self._next_hop_ids[next_hop] = len(self.next_hops)
+            self.next_hops.append(next_hop)
+        self.network.append(int.from_bytes(packed, "big"))
+        self.length.append(int(length or 32))
+        self.next_hop.append(hop_id)
+        self.protocol.append(PROTOCOL_CODES.get(protocol, 0))
+
+    def columns(self):
+        """
+        Return (network, length, next_hop, protocol) as numpy arrays.
+        """
+        return (
+            np.frombuffer(self.network, dtype=np.uint32),
+            np.frombuffer(self.length, dtype=np.uint8),
+            np.frombuffer(self.next_hop, dtype=np.uint32),
+            np.frombuffer(self.protocol, dtype=np.uint8),
+        )
+
+
+def iter_routes(chunks):
+    """
+    Stream (destination, next hop, protocol) out of a get-route-information
+    reply, using each <rt>'s active entry.
+
+    Fields are picked up from parser events as they close rather than
+    searched for afterwards, and every <rt> is dropped once read, so a
+    full table streams through in constant memory.
+    """
+    route = {}
+    entry = {}
+    for name, elem in iter_elements(chunks, release=("rt",)):
+        if name in ROUTE_FIELDS:
+            entry.setdefault(name, (elem.text or "").strip())
+        elif name == "rt-entry":
+            # Keep the active entry, or the first one if none is marked
+            if "entry" not in route or entry.get("active-tag") == "*":
+                route["entry"] = dict(entry)
+            entry.clear()
+        elif name == "rt-destination" or name == "rt-prefix-length":
+            route[name] = (elem.text or "").strip()
+        elif name == "rt":
+            yield route_fields(route)
+            route.clear()
+
+
+def route_fields(route):
+    destination = route.get("rt-destination", "")
+    length = route.get("rt-prefix-length")
+    if length and "/" not in destination:
+        destination = f"{destination}/{length}"
+    entry = route.get("entry", {})
+    next_hop = entry.get("to") or entry.get("via") or entry.get("nh-type", "")
+    return destination, next_hop, entry.get("protocol-name", "")
+
+
+def parse_rib(reply, device=None):
+    """
+    Decode a get-route-information reply into a RibTable.
+    """
+    table = RibTable(device)
+    for destination, next_hop, protocol in iter_routes(iter_chunks(reply)):
+        if destination:
+            table.add(destination, next_hop, protocol)
+    return table
+
+
+def fetch_rib(pool, device, table="inet.0"):
+    """
+    Pull one routing table from device.
+    """
+    reply = pool.rpc(device, ROUTE_RPC.format(table=table))
+    return parse_rib(reply, device["host"])
+
+
+def route_keys(table):
+    """
+    One uint64 per route: network << 8 | length.
+    """
+    network, length, _, _ = table.columns()
+    return (network.astype(np.uint64) << np.uint64(8)) | length
+
+
+def prefix_counts(table):
+    """
+    Return ({protocol: routes}, {prefix length: routes}).
+    """
+    if np is None:
+        protocols = Counter(PROTOCOLS[code] for code in table.protocol)
+        return dict(protocols), dict(sorted(Counter(table.length).items()))
+    _, length, _, protocol = table.columns()
+    by_protocol = np.bincount(protocol, minlength=len(PROTOCOLS))
+    by_length = np.bincount(length, minlength=33)
+    return (
+        {PROTOCOLS[code]: int(count) for code, count in enumerate(by_protocol) if count},
+        {bits: int(count) for bits, count in enumerate(by_length) if count},
+    )
+
+
+def aggregate(table, length):
+    """
+    Count routes by the /length block that covers them (shorter routes
+    are left out). Returns {block as "a.b.c.d/length": routes}.
+    """
+    shift = 32 - length
+    if np is None:
+        blocks = Counter(
+            network >> shift for network, bits in zip(table.network, table.length) if bits >= length
+        )
+    else:
+        network, bits, _, _ = table.columns()
+        covered = network[bits >= length] >> np.uint32(shift)
+        values, counts = np.unique(covered, return_counts=True)
+        blocks = dict(zip(values.tolist(), counts.tolist()))
+    return {
+        f"{socket.inet_ntoa((block << shift).to_bytes(4, 'big'))}/{length}": count
+        for block, count in sorted(blocks.items())
+    }
+
+
+def diff_ribs(a, b):
+    """
+    Compare two RibTables.
+
+    Returns (only in a, only in b, next hop differs) as lists of
+    "prefix/len" strings. Next hops are compared by address, since each
+    table numbers its own next hops.
+    """
+    if np is None:
+        routes_a = {(n, l): a.next_hops[h] for n, l, h in zip(a.network, a.length, a.next_hop)}
+        routes_b = {(n, l): b.next_hops[h] for n, l, h in zip(b.network, b.length, b.next_hop)}
+        only_a = sorted(routes_a.keys() - routes_b.keys())
+        only_b = sorted(routes_b.keys() - routes_a.keys())
+        changed = sorted(k for k in routes_a.keys() & routes_b.keys() if routes_a[k] != routes_b[k])
+        return [[f"{socket.inet_ntoa(n.to_bytes(4, 'big'))}/{l}" for n, l in keys]
+                for keys in (only_a, only_b, changed)]
+
+    keys_a, keys_b = route_keys(a), route_keys(b)
+    # Translate b's next-hop ids into a's numbering (-1 if a never uses it)
+    translate = np.array([a._next_hop_ids.get(hop, -1) for hop in b.next_hops], dtype=np.int64)
+    hops_a = a.columns()[2].astype(np.int64)
+    hops_b = translate[b.columns()[2]] if len(translate) else np.zeros(0, dtype=np.int64)
+
+    # Active paths only, so each table holds a destination at most once
+    common, index_a, index_b = np.intersect1d(keys_a, keys_b, assume_unique=True, return_indices=True)
+    changed = common[hops_a[index_a] != hops_b[index_b]]
+    only_a = np.setdiff1d(keys_a, keys_b, assume_unique=True)
+    only_b = np.setdiff1d(keys_b, keys_a, assume_unique=True)
+    # setdiff1d keeps input order when told the keys are unique; sort like the fallback
+    return [format_keys(np.sort(keys)) for keys in (only_a, only_b, changed)]
+
+
+def format_keys(keys):
+    return [
+        f"{socket.inet_ntoa(int(key >> 8).to_bytes(4, 'big'))}/{int(key & 0xff)}"
+        for key in keys.tolist()
+    ]
+
+
+if __name__ == "__main__":
+    from junos_fleet import MAX_WORKERS, iter_fleet
+    from junos_inventory import load_inventory
+    from junos_sessions import NetconfSessionPool
+
+    parser = argparse.ArgumentParser(description="Pull routing tables and compare them across devices.")
+    parser.add_argument("hosts", nargs="+", help="Devices to collect; the first is the reference for diffs")
+    parser.add_argument("--inventory", default="device_inventory.yml",
+                        help="Device inventory file (default: device_inventory.yml)")
+    parser.add_argument("--table", default="inet.0", help="Routing table to pull (default: inet.0)")
+    parser.add_argument("--aggregate", type=int, metavar="LENGTH",
+                        help="Also count each device's routes per covering /LENGTH block")
+    parser.add_argument("--show", type=int, default=10,
+                        help="Prefixes listed per difference category (default: 10)")
+    args = parser.parse_args()
+
+    inventory = load_inventory(args.inventory)
+    devices = [inventory.get(host) for host in args.hosts]
+    missing = [host for host, device in zip(args.hosts, devices) if device is None]
+    if missing:
+        parser.error(f"Not in the inventory: {', '.join(missing)}")
+
+    tables = []
+    with NetconfSessionPool() as pool:
+        for device, table, error in iter_fleet(devices, lambda d: fetch_rib(pool, d, args.table),
+                                               max_workers=MAX_WORKERS):
+            if error:
+                print(f"Error processing device {device['host']}: {error}")
+                continue
+            protocols, lengths = prefix_counts(table)
+            print(f"{device['host']}: {len(table)} routes ({table.skipped} non-IPv4 skipped)")
+            print("  by protocol: " + ", ".join(f"{name} {count}" for name, count in protocols.items()))
+            if args.aggregate:
+                for block, count in list(aggregate(table, args.aggregate).items())[:args.show]:
+                    print(f"  {block}: {count}")
+            tables.append(table)
+
+    for other in tables[1:]:
+        only_a, only_b, changed = diff_ribs(tables[0], other)
+        print(f"\n{tables[0].device} vs {other.device}: {len(only_a)} only in {tables[0].device}, "
+              f"{len(only_b)} only in {other.device}, {len(changed)} with a different next hop")
+        for label, prefixes in (("-", only_a), ("+", only_b), ("~", changed)):
+            for prefix in prefixes[:args.show]:
+                print(f"  {label} {prefix}")
@@ -0,0 +1,276 @@
+import hashlib
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from ncclient import manager
+from ncclient.operations import TimeoutExpiredError
+from ncclient.transport.errors import TransportError
+from ncclient.xml_ import to_ele
+
+from junos_fleet import CONNECT_TIMEOUT, RPC_TIMEOUT
+from junos_metrics import timed
+
+# Session pool defaults
+KEEPALIVE_INTERVAL = 30
+IDLE_TIMEOUT = 300
+
+# Keys credential digests so they mean nothing outside this process
+CREDENTIAL_SALT = os.urandom(16)
+
+
+class RpcReplyError(Exception):
+    """Raised when a device answers an RPC with an <rpc-error>."""
+
+
+class DeviceUnreachable(Exception):
+    """Raised by a broker client when the broker could not reach the device."""
+
+
+# Failures meaning a device could not be reached, rather than that it answered badly
+UNREACHABLE_ERRORS = (OSError, TransportError, TimeoutExpiredError, DeviceUnreachable)
+
+
+def session_key(device):
+    """
+    Return the (host, port, user, credential digest) key a device's session
+    is pooled under. A changed or wrong password never reuses a session
+    opened with the old one.
+    """
+    credential = hashlib.blake2b(str(device.get("password")).encode(), key=CREDENTIAL_SALT, digest_size=16)
+    return device["host"], device.get("port", 830), device["user"], credential.hexdigest()
+
+
+def send_rpc(conn, rpc):
+    """
+    Send an RPC (XML string) without waiting for its reply.
+
+    Returns the pending ncclient operation; pass it to wait_reply().
+    """
+    async_mode = conn.async_mode
+    conn.async_mode = True
+    try:
+        return conn.dispatch(to_ele(rpc))
+    finally:
+        conn.async_mode = async_mode
+
+
+def wait_reply(pending, timeout):
+    """
+    Wait for a pending RPC and return the raw reply text.
+
+    The reply is handed back unparsed so callers can stream through it
+    instead of ncclient building a full document tree first.
+    """
+    if not pending.event.wait(timeout):
+        raise TimeoutExpiredError(f"no RPC reply within {timeout}s")
+    if pending.error:
+        raise pending.error
+    return pending.reply.xml
+
+
+class PooledSession:
+    """A NETCONF session plus the bookkeeping the pool needs."""
+
+    def __init__(self, key, site=None):
+        self.key = key
+        self.site = site
+        self.conn = None
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def connected(self):
+        return self.conn is not None and self.conn.connected
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close_session()
+            except Exception:
+                pass
+            self.conn = None
+
+
+class NetconfSessionPool:
+    """
+    Keep NETCONF sessions open between operations, keyed by (host, port, user).
+
+    Sessions get SSH keep-alives, are reopened on demand if they drop, and
+    are closed by a background reaper once idle for idle_timeout seconds.
+    """
+
+    def __init__(self, keepalive=KEEPALIVE_INTERVAL, idle_timeout=IDLE_TIMEOUT,
+                 connect_timeout=CONNECT_TIMEOUT, rpc_timeout=RPC_TIMEOUT, metrics=None):
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.rpc_timeout = rpc_timeout
+        self.metrics = metrics
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._reaper = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close_all()
+
+    def _open(self, device, device_params=None):
+        """
+        Open a new NETCONF session to device.
+        """
+        host, port, site = device["host"], device.get("port", 830), device.get("site")
+        with timed(self.metrics, host, "tcp_connect", site):
+            sock = socket.create_connection((host, port), timeout=self.connect_timeout)
+        with timed(self.metrics, host, "ssh_setup", site):
+            try:
+                conn = manager.connect(
+                    host=host,
+                    port=port,
+                    sock=sock,
+                    username=device["user"],
+                    password=device["password"],
+                    hostkey_verify=False,
+                    allow_agent=False,
+                    look_for_keys=False,
+                    timeout=self.connect_timeout,
+                    keepalive=self.keepalive,
+                    device_params=device_params or {"name": "junos"},
+                )
+            except Exception:
+                sock.close()
+                raise
+        conn.timeout = self.rpc_timeout
+        return conn
+
+    def _close(self, pooled):
+        if pooled.conn is None:
+            return
+        with timed(self.metrics, pooled.key[0], "close", pooled.site):
+            pooled.close()
+
+    def _start_reaper(self):
+        if self._reaper is None and self.idle_timeout:
+            self._reaper = threading.Thread(target=self._reap, name="netconf-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap(self):
+        interval = max(1, min(self.idle_timeout / 2, 60))
+        while not self._closed.wait(interval):
+            self.evict_idle()
+
+    @contextmanager
+    def session(self, device):
+        """
+        Yield a connected ncclient manager for device, reusing a pooled one.
+
+        The session is held exclusively for the duration of the block, so
+        several RPCs can run back to back on it.
+        """
+        key = session_key(device)
+        with self._lock:
+            pooled = self._sessions.get(key)
+            if pooled is None:
+                pooled = self._sessions[key] = PooledSession(key, device.get("site"))
+            self._start_reaper()
+
+        with pooled.lock:
+            if not pooled.connected:
+                self._close(pooled)
+                pooled.conn = self._open(device)
+            try:
+                yield pooled.conn
+            finally:
+                pooled.last_used = time.monotonic()
+
+    def connect(self, device, device_params=None):
+        """
+        Open a session to device outside the pool, for long-lived uses such
+        as notification subscriptions. The caller closes it.
+        """
+        return self._open(device, device_params)
+
+    def rpc(self, device, rpc):
+        """
+        Run an RPC (XML string) on device and return the raw reply text.
+
+        A session that dropped since its last use is reopened and the RPC
+        retried once.
+        """
+        return self.rpc_bundle(device, {"reply": rpc})["reply"]
+
+    def rpc_bundle(self, device, rpcs):
+        """
+        Run several RPCs pipelined on one session and return their raw replies.
+
+        rpcs maps a name to an RPC (XML string). Every RPC is sent before
+        any reply is awaited and ncclient matches replies to requests by
+        message-id, so the bundle costs about one round trip instead of
+        one per RPC. Returns a dict with the same names mapped to replies.
+        """
+        for attempt in range(2):
+            with self.session(device) as conn:
+                try:
+                    with timed(self.metrics, device["host"], "rpc", device.get("site")):
+                        pending = {name: send_rpc(conn, rpc) for name, rpc in rpcs.items()}
+                        deadline = time.monotonic() + self.rpc_timeout
+                        return {
+                            name: wait_reply(op, max(deadline - time.monotonic(), 0))
+                            for name, op in pending.items()
+                        }
+                except TransportError:
+                    if attempt:
+                        raise
+                    self.discard(device)
+
+    def discard(self, device):
+        """
+        Close the pooled session for device so the next use reopens it.
+        """
+        with self._lock:
+            pooled = self._sessions.get(session_key(device))
+        if pooled is not None:
+            self._close(pooled)
+
+    def open_sessions(self):
+        """
+        Return (host, port, user) of currently connected sessions.
+        """
+        with self._lock:
+            return [key[:3] for key, pooled in self._sessions.items() if pooled.connected]
+
+    def evict_idle(self):
+        """
+        Close sessions that have not been used for idle_timeout seconds.
+        """
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            sessions = list(self._sessions.values())
+
+        evicted = 0
+        for pooled in sessions:
+            if pooled.last_used >= cutoff or not pooled.lock.acquire(blocking=False):
+                continue
+            try:
+                if pooled.conn is not None and pooled.last_used < cutoff:
+                    self._close(pooled)
+                    evicted += 1
+            finally:
+                pooled.lock.release()
+        return evicted
+
+    def close_all(self):
+        """
+        Close every pooled session and stop the reaper.
+        """
+        self._closed.set()
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for pooled in sessions:
+            self._close(pooled)
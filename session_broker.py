@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import signal
+import socket
+import socketserver
+import threading
+
+from junos_fleet import CONNECT_TIMEOUT, RPC_TIMEOUT
+from junos_metrics import timed
+from junos_sessions import UNREACHABLE_ERRORS, DeviceUnreachable, NetconfSessionPool, RpcReplyError
+
+# Where clients look for the broker unless told otherwise
+DEFAULT_SOCKET = os.environ.get("JUNOS_BROKER_SOCKET", os.path.expanduser("~/.junos_broker.sock"))
+
+# Brokered sessions outlive many short script runs
+BROKER_IDLE_TIMEOUT = 1800
+
+
+class BrokerError(Exception):
+    """Raised on the client side when the broker reports a failure."""
+
+
+class BrokerHandler(socketserver.StreamRequestHandler):
+    """
+    Serve JSON-line requests from one client connection.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                response = {"ok": True, **self.server.dispatch(request)}
+            except Exception as e:
+                response = {"ok": False, "error": str(e), "type": type(e).__name__,
+                            "unreachable": isinstance(e, UNREACHABLE_ERRORS)}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class SessionBroker(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Own long-lived NETCONF sessions and run RPCs on them for local clients.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path=DEFAULT_SOCKET, pool=None):
+        self.pool = pool or NetconfSessionPool(idle_timeout=BROKER_IDLE_TIMEOUT)
+        if os.path.exists(path):
+            os.unlink(path)
+        # Only the owner may talk to the broker; requests carry passwords
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(path, BrokerHandler)
+        finally:
+            os.umask(old_umask)
+        self.path = path
+
+    def dispatch(self, request):
+        op = request.get("op")
+        if op == "bundle":
+            return {"replies": self.pool.rpc_bundle(request["device"], request["rpcs"])}
+        if op == "discard":
+            self.pool.discard(request["device"])
+            return {}
+        if op == "status":
+            return {"sessions": [list(key) for key in self.pool.open_sessions()]}
+        raise ValueError(f"Unknown broker operation '{op}'")
+
+    def server_close(self):
+        super().server_close()
+        self.pool.close_all()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class BrokerClient:
+    """
+    Drop-in stand-in for NetconfSessionPool that runs RPCs through the broker.
+
+    Sessions are opened inside the broker, so metrics only sees each
+    broker round trip, recorded as the rpc phase.
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET, timeout=CONNECT_TIMEOUT + RPC_TIMEOUT, metrics=None):
+        self.path = path
+        self.timeout = timeout
+        self.metrics = metrics
+
+    def _call(self, request):
+        # A broker that went away is not the device's fault
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.path)
+                sock.sendall(json.dumps(request).encode() + b"\n")
+                with sock.makefile("rb") as f:
+                    line = f.readline()
+        except OSError as e:
+            raise BrokerError(f"Broker unavailable: {e}") from e
+        if not line:
+            raise BrokerError("Broker closed the connection without replying")
+        response = json.loads(line)
+        if not response.pop("ok"):
+            if response.get("type") == "RpcReplyError":
+                error = RpcReplyError
+            elif response.get("unreachable"):
+                error = DeviceUnreachable
+            else:
+                error = BrokerError
+            raise error(response.get("error"))
+        return response
+
+    def rpc(self, device, rpc):
+        return self.rpc_bundle(device, {"reply": rpc})["reply"]
+
+    def rpc_bundle(self, device, rpcs):
+        with timed(self.metrics, device["host"], "rpc", device.get("site")):
+            return self._call({"op": "bundle", "device": device, "rpcs": rpcs})["replies"]
+
+    def discard(self, device):
+        self._call({"op": "discard", "device": device})
+
+    def status(self):
+        return self._call({"op": "status"})["sessions"]
+
+    def close_all(self):
+        """
+        Sessions belong to the broker, so there is nothing to close here.
+        """
+
+
+def broker_available(path=DEFAULT_SOCKET):
+    """
+    Return True if a broker is listening on path.
+    """
+    if not os.path.exists(path):
+        return False
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(1)
+            sock.connect(path)
+        return True
+    except OSError:
+        return False
+
+
+def connect_pool(broker_path=DEFAULT_SOCKET, use_broker=True, **pool_options):
+    """
+    Return a BrokerClient if a broker is running, else a private session pool.
+    """
+    if use_broker and broker_available(broker_path):
+        print(f"Using session broker at {broker_path}")
+        return BrokerClient(broker_path, timeout=pool_options.get("connect_timeout", CONNECT_TIMEOUT)
+                            + pool_options.get("rpc_timeout", RPC_TIMEOUT), metrics=pool_options.get("metrics"))
+    return NetconfSessionPool(**pool_options)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep NETCONF sessions warm for short-lived scripts.")
+    parser.add_argument("command", choices=("serve", "status"), help="Run the broker or list its sessions")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help=f"Unix socket path (default: {DEFAULT_SOCKET})")
+    parser.add_argument("--idle-timeout", type=float, default=BROKER_IDLE_TIMEOUT,
+                        help=f"Close sessions unused for this many seconds (default: {BROKER_IDLE_TIMEOUT})")
+    parser.add_argument("--connect-timeout", type=float, default=CONNECT_TIMEOUT,
+                        help=f"Seconds allowed for each device to connect (default: {CONNECT_TIMEOUT})")
+    parser.add_argument("--rpc-timeout", type=float, default=RPC_TIMEOUT,
+                        help=f"Seconds allowed for each RPC (default: {RPC_TIMEOUT})")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        sessions = BrokerClient(args.socket).status()
+        print(f"{len(sessions)} open session(s)")
+        for host, port, user in sessions:
+            print(f"  {user}@{host}:{port}")
+        exit()
+
+    pool = NetconfSessionPool(idle_timeout=args.idle_timeout, connect_timeout=args.connect_timeout,
+                              rpc_timeout=args.rpc_timeout)
+    broker = SessionBroker(args.socket, pool)
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=broker.shutdown).start())
+    print(f"Session broker listening on {args.socket}", flush=True)
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        broker.server_close()